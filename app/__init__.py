@@ -12,35 +12,95 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+
 """
 Microservice module
 
 This module contains the microservice code for
     server
     models
+
+Apps are made by create_app(), which only reads the configuration and
+registers the routes. The database driver is imported and the engine is
+connected when the first query runs, so importing this package and
+starting a worker stay fast. The module level app is the default app for
+run.py, gunicorn (app:app) and the tests, and is only created when it is
+first used.
 """
+import sys
+import time
+import logging
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
-# Uncomment next line to use MySQL
-#import pymysql
-# Uncomment next line to use PostgreSQL
-import psycopg2
-
-# These next 4 lines are positional:
-# 1) We need to create the Flask app
-# 2) Then configure it for the database
-# 3) Then initialize SQLAlchemy after it has been configured
-# 4) Finally we can import our database models
-
-app = Flask(__name__)
-# Load the confguration
-with app.app_context():
+from app.pool import SQLAlchemy, pool_metrics
+from app.vcap_services import get_database_uri
+from app.replicas import ReplicaRouter, replica_binds
+
+IMPORT_STARTED = time.perf_counter()
+
+# The extension is bound to each app by init_app() in create_app()
+db = SQLAlchemy()
+
+_default_app = None
+
+
+def create_app(config=None):
+    """
+    Creates and configures a Pet Service app
+
+    config is a mapping of settings that override the ones in config.py,
+    so tests can build isolated apps with their own database.
+    """
+    started = time.perf_counter()
+    app = Flask(__name__)
+    # Load the confguration
     app.config.from_object('config')
+    if config:
+        app.config.update(config)
+    if not app.config.get('SQLALCHEMY_DATABASE_URI'):
+        app.config['SQLALCHEMY_DATABASE_URI'] = get_database_uri()
     app.logger.debug('Database URI {}'.format(app.config['SQLALCHEMY_DATABASE_URI']))
 
-# Initialize SQLAlchemy
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+    # Each read replica is a bind of its own
+    replicas = replica_binds(app.config['DATABASE_REPLICA_URIS'])
+    app.config['SQLALCHEMY_BINDS'] = dict(app.config.get('SQLALCHEMY_BINDS') or {}, **replicas)
+    app.extensions['replicas'] = (ReplicaRouter(sorted(replicas), app.config['REPLICA_HEALTH_INTERVAL'])
+                                  if replicas else None)
+
+    # Initialize SQLAlchemy with an instrumented connection pool
+    pool_metrics.slow_threshold = app.config['POOL_SLOW_THRESHOLD']
+    db.init_app(app)
+    if 'flask_migrate' in sys.modules:
+        # The flask db commands import flask_migrate before they load the
+        # app, so everything else skips importing alembic
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    server.init_app(app)
+
+    app.extensions['startup'] = {
+        'import_seconds': IMPORT_SECONDS,
+        'create_seconds': time.perf_counter() - started,
+        'created': started,
+        'first_request_seconds': None,
+    }
+    return app
+
+def get_app():
+    """ Returns the default app, creating it on first use """
+    global _default_app    # pylint: disable=global-statement
+    if _default_app is None:
+        _default_app = create_app()
+        # the default app is used when there is no app context
+        db.app = _default_app
+        logging.getLogger(__name__).info('Created the default app in %.1f ms',
+                                         _default_app.extensions['startup']['create_seconds'] * 1000)
+    return _default_app
+
+def __getattr__(name):
+    """ Creates the default app the first time app is imported """
+    if name == 'app':
+        return get_app()
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+from app import server, models    # pylint: disable=wrong-import-position
 
-from app import server, models
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
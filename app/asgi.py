@@ -0,0 +1,263 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+ASGI Server
+
+This module serves the Pet API from an ASGI server so that one process can
+keep many requests open while they wait on the database:
+
+    uvicorn app.asgi:application --host 0.0.0.0 --port 5000
+
+The read endpoints that take most of the traffic are async views that run
+their queries on an AsyncSession with an async driver (asyncpg for
+PostgreSQL, aiosqlite for SQLite):
+
+GET /pets - with the id, category, name, available, limit and cursor parameters
+GET /pets/{id}
+GET /categories - with the limit and cursor parameters
+GET /categories/{id}
+
+They use the same Pet and Category models and send the same bodies and
+ETags as the Flask views. Every other request, including the list options
+that stream or embed, is passed to the Flask app through the asgiref WSGI
+adapter, which runs it on a worker thread.
+"""
+import re
+from urllib.parse import parse_qsl, urlencode
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import NotFound
+from werkzeug.http import parse_etags, quote_etag
+from asgiref.wsgi import WsgiToAsgi
+from flask_api import status    # HTTP Status Codes
+from sqlalchemy import select
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from app import app, server
+from app.models import Pet, Category, ChangeCounter, DataValidationError
+from app.pagination import keyset_query, encode_cursor
+from app.encoding import encode_json
+
+# Async drivers for each of the database backends
+ASYNC_DRIVERS = {
+    'postgres': 'postgresql+asyncpg',
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+# List parameters that need the Flask views
+FLASK_ONLY_ARGS = ('stream', 'include', 'embed')
+
+
+def get_async_database_uri(config):
+    """ Returns the database uri with the sync driver swapped for an async one """
+    if config.get('ASYNC_DATABASE_URI'):
+        return config['ASYNC_DATABASE_URI']
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError('No async driver for database {}'.format(backend))
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+class AsyncDatabase(object):
+    """ Async engine and session factory, created on the first request """
+
+    def __init__(self):
+        self.engine = None
+        self.session_factory = None
+
+    def session(self):
+        """ Returns a new AsyncSession """
+        if self.engine is None:
+            self.engine = create_async_engine(get_async_database_uri(app.config))
+            self.session_factory = sessionmaker(self.engine, class_=AsyncSession,
+                                                expire_on_commit=False)
+        return self.session_factory()
+
+    async def dispose(self):
+        """ Closes the connections in the pool """
+        if self.engine is not None:
+            await self.engine.dispose()
+            self.engine = None
+
+async_db = AsyncDatabase()
+wsgi_application = WsgiToAsgi(app)
+
+
+######################################################################
+#  A S Y N C   V I E W S
+######################################################################
+
+async def list_pets(session, request):
+    """ Returns all of the Pets """
+    app.logger.info('Listing Pets (async)...')
+    filters = server.get_pet_filters(args=request.args)
+    statement = select(*Pet.row_columns()).where(*Pet.filter_criteria(**filters))
+    return await make_list_response(session, request, statement, [Pet.id])
+
+async def get_pets(session, request, pet_id):
+    """ Retrieve a single Pet """
+    app.logger.info('Retrieve a Pet with ID:(%s) (async)...', pet_id)
+    pet = await session.get(Pet, pet_id)
+    if not pet:
+        return make_error(status.HTTP_404_NOT_FOUND, 'Not Found',
+                          str(NotFound("Pet with id '{}' was not found.".format(pet_id))))
+    return make_etag_response(request, str(pet.version), pet.serialize())
+
+async def list_categories(session, request):
+    """ Returns all of the Categories """
+    app.logger.info('Listing Categories (async)...')
+    return await make_list_response(session, request, select(*Category.row_columns()), [Category.id])
+
+async def get_categories(session, request, category_id):
+    """ Retrieve a single Category """
+    app.logger.info('Retrieve a Category with ID:(%s) (async)...', category_id)
+    category = await session.get(Category, category_id)
+    if not category:
+        return make_error(status.HTTP_404_NOT_FOUND, 'Not Found',
+                          str(NotFound("Category with id '{}' was not found.".format(category_id))))
+    return make_etag_response(request, str(category.version), category.serialize())
+
+# (path pattern, view) of the async views
+ROUTES = [
+    (re.compile(r'^/pets$'), list_pets),
+    (re.compile(r'^/pets/(\d+)$'), get_pets),
+    (re.compile(r'^/categories$'), list_categories),
+    (re.compile(r'^/categories/(\d+)$'), get_categories),
+]
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+
+class AsyncRequest(object):
+    """ The parts of an ASGI request that the async views read """
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.path = scope['path']
+        self.query_string = scope.get('query_string', b'').decode('latin-1')
+        self.args = MultiDict(parse_qsl(self.query_string, keep_blank_values=True))
+        self.headers = dict((name.decode('latin-1').lower(), value.decode('latin-1'))
+                            for name, value in scope.get('headers', []))
+
+    def url_with(self, **args):
+        """ Returns the absolute url of this request with some arguments replaced """
+        query = self.args.copy()
+        for name, value in args.items():
+            query[name] = value
+        host = self.headers.get('host', 'localhost')
+        url = '{}://{}{}'.format(self.scope.get('scheme', 'http'), host, self.path)
+        return url + '?' + urlencode(list(query.items(multi=True)))
+
+def find_view(scope):
+    """ Returns the async view and its arguments for a request or None """
+    if scope['type'] != 'http' or scope['method'] != 'GET':
+        return None, ()
+    request = AsyncRequest(scope)
+    if any(name in request.args for name in FLASK_ONLY_ARGS):
+        return None, ()
+    if 'application/x-ndjson' in request.headers.get('accept', ''):
+        return None, ()
+    for pattern, view in ROUTES:
+        match = pattern.match(request.path)
+        if match:
+            return view, [request] + [int(group) for group in match.groups()]
+    return None, ()
+
+def encode(data):
+    """ Encodes data the same way as jsonify """
+    return encode_json(data, app)
+
+def make_error(code, error, message):
+    """ Makes an error response with the same body as the Flask error handlers """
+    return code, [], encode({'status': code, 'error': error, 'message': message})
+
+def is_not_modified(request, etag):
+    """ Returns True if the client already has the etag """
+    return parse_etags(request.headers.get('if-none-match')).contains_weak(etag)
+
+def make_etag_response(request, etag, data):
+    """ Makes a 200 OK response with an etag, or a 304 if the client has it """
+    headers = [('ETag', quote_etag(etag))]
+    if is_not_modified(request, etag):
+        return status.HTTP_304_NOT_MODIFIED, headers, b''
+    return status.HTTP_200_OK, headers, encode(data)
+
+async def make_list_response(session, request, statement, columns):
+    """ Makes a paginated response for a list statement """
+    limit, cursor = server.get_page_args(args=request.args)
+    result = await session.execute(select(ChangeCounter.name, ChangeCounter.generation))
+    etag = server.make_list_etag(request.path, request.args, None, dict(result.all()))
+    headers = [('ETag', quote_etag(etag))]
+    if is_not_modified(request, etag):
+        return status.HTTP_304_NOT_MODIFIED, headers, b''
+    statement = keyset_query(statement, columns, cursor)
+    if limit is not None:
+        # fetch one extra row to find out if there is another page
+        statement = statement.limit(limit + 1)
+    rows = (await session.execute(statement)).all()
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([getattr(rows[-1], column.key) for column in columns])
+        headers.append(('X-Next-Cursor', next_cursor))
+        headers.append(('Link', '<{}>; rel="next"'.format(request.url_with(cursor=next_cursor))))
+    return status.HTTP_200_OK, headers, encode([server.serialize_row(row) for row in rows])
+
+async def send_response(send, code, headers, body):
+    """ Sends a JSON response to the ASGI server """
+    raw_headers = [(b'content-length', str(len(body)).encode('latin-1'))]
+    if body:
+        raw_headers.append((b'content-type', b'application/json'))
+    raw_headers.extend((name.lower().encode('latin-1'), value.encode('latin-1'))
+                       for name, value in headers)
+    await send({'type': 'http.response.start', 'status': code, 'headers': raw_headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def lifespan(receive, send):
+    """ Handles the ASGI server starting up and shutting down """
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await async_db.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+######################################################################
+#   A S G I   A P P L I C A T I O N
+######################################################################
+
+async def application(scope, receive, send):
+    """ Runs the async view for a request or passes it to the Flask app """
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    view, args = find_view(scope)
+    if view is None:
+        await wsgi_application(scope, receive, send)
+        return
+    async with async_db.session() as session:
+        try:
+            with app.app_context():
+                code, headers, body = await view(session, *args)
+        except DataValidationError as error:
+            app.logger.info(str(error))
+            code, headers, body = make_error(status.HTTP_400_BAD_REQUEST, 'Bad Request', str(error))
+    await send_response(send, code, headers, body)
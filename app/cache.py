@@ -0,0 +1,146 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Result Cache
+
+This module caches the encoded bodies of list responses. Keys include the
+generation of every table the list was read from, so a write never has to
+find and delete entries: it bumps the generation and the old entries are
+simply never asked for again until they are evicted.
+
+Backends:
+---------
+memory - an LRU dictionary in each worker process (the default)
+redis - a Redis server shared by all of the workers
+none - don't cache
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+
+class MemoryCache(object):
+    """ Least recently used cache in the memory of this process """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """ Returns the value of a key or None """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """ Stores a value, evicting the least recently used one when full """
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """ Removes every entry """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """ Returns the hit and miss counters of the cache """
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+class RedisCache(object):
+    """
+    Cache shared by every worker through a Redis server
+
+    Any client with Redis style get(key) and set(key, value, ex=seconds)
+    methods can be used, so a local stand-in can replace the server.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, client, ttl=300, prefix='pets:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """ Returns the value of a key or None if it's missing or Redis is down """
+        try:
+            value = self.client.get(self.prefix + key)
+        except Exception as error:  # pylint: disable=broad-except
+            self.logger.warning('Result cache get failed: %s', error)
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """ Stores a value that expires after the ttl """
+        try:
+            self.client.set(self.prefix + key, value, ex=self.ttl)
+        except Exception as error:  # pylint: disable=broad-except
+            self.logger.warning('Result cache set failed: %s', error)
+
+    def clear(self):
+        """ Entries are left to expire because other workers share them """
+
+    def stats(self):
+        """ Returns the hit and miss counters of this worker """
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class NullCache(object):
+    """ Cache that never stores anything """
+
+    def get(self, key):
+        """ Always misses """
+        return None
+
+    def set(self, key, value):
+        """ Drops the value """
+
+    def clear(self):
+        """ There is nothing to clear """
+
+    def stats(self):
+        """ There are no counters """
+        return {}
+
+
+def create_cache(config):
+    """ Creates the result cache backend named in the app config """
+    backend = config.get('RESULT_CACHE_BACKEND', 'memory')
+    if backend == 'memory':
+        return MemoryCache(config.get('RESULT_CACHE_SIZE', 1024))
+    if backend == 'redis':
+        import redis    # only needed when the shared cache is used
+        client = redis.from_url(config['RESULT_CACHE_URL'])
+        return RedisCache(client, config.get('RESULT_CACHE_TTL', 300))
+    if backend == 'none':
+        return NullCache()
+    raise ValueError('Unknown RESULT_CACHE_BACKEND: {}'.format(backend))
@@ -0,0 +1,55 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+JSON Encoding
+
+This module encodes response bodies to exactly the bytes jsonify would
+send. When orjson is installed it does the encoding, sorting keys like
+JSON_SORT_KEYS does, and the result is only used when it is pure ASCII:
+anything else would have been escaped by JSON_AS_ASCII, so it is encoded
+again with the standard library instead.
+"""
+from flask import json
+
+try:
+    import orjson
+except ImportError:     # orjson is optional, the standard library is the fallback
+    orjson = None
+
+ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE if orjson else 0
+
+
+def can_use_orjson(app):
+    """ Returns True if orjson encodes the same way as jsonify for this app """
+    return (orjson is not None
+            and not (app.config['JSONIFY_PRETTYPRINT_REGULAR'] or app.debug)
+            and app.config['JSON_SORT_KEYS']
+            and app.config['JSON_AS_ASCII']
+            and app.json_encoder is json.JSONEncoder)
+
+def encode_json(data, app):
+    """ Encodes data to the same bytes as the body of jsonify(data) """
+    if can_use_orjson(app):
+        try:
+            body = orjson.dumps(data, option=ORJSON_OPTIONS)
+        except TypeError:   # a type only the Flask encoder knows, like Decimal
+            body = None
+        if body is not None and body.isascii():
+            return body
+    if app.config['JSONIFY_PRETTYPRINT_REGULAR'] or app.debug:
+        text = json.dumps(data, app=app, indent=2, separators=(', ', ': '))
+    else:
+        text = json.dumps(data, app=app, separators=(',', ':'))
+    return (text + '\n').encode('utf-8')
@@ -0,0 +1,109 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Request Logging
+
+This module keeps logging off the request path:
+
+QueueLogHandler - hands records to a listener thread that writes them, and
+    drops them instead of waiting when the queue is full
+SamplingFilter - keeps the INFO messages of only a sample of the requests
+    to the busiest endpoints, decided once per request
+log_access - writes one JSON line per request with its timing
+"""
+import json
+import queue
+import random
+import logging
+import logging.handlers
+from flask import g, request, has_request_context
+
+access_logger = logging.getLogger('app.access')
+
+
+class QueueLogHandler(logging.handlers.QueueHandler):
+    """ QueueHandler that never blocks a request on a full queue """
+
+    def __init__(self, log_queue):
+        super(QueueLogHandler, self).__init__(log_queue)
+        # the message is merged here and the listener's handlers add the rest
+        self.setFormatter(logging.Formatter('%(message)s'))
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps the INFO and DEBUG records of a sample of the requests
+
+    rates maps an endpoint name to the fraction of its requests that are
+    logged, e.g. {'list_pets': 0.01}. Endpoints that are not listed and
+    records at WARNING or above are always kept.
+    """
+
+    def __init__(self, rates):
+        super(SamplingFilter, self).__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno > logging.INFO or not self.rates or not has_request_context():
+            return True
+        if record.name == access_logger.name:
+            return True
+        endpoint = request.endpoint
+        rate = self.rates.get(endpoint.rpartition('.')[2] if endpoint else None)
+        if rate is None:
+            return True
+        sampled = g.get('log_sampled')
+        if sampled is None:
+            sampled = g.log_sampled = random.random() < rate
+        return sampled
+
+
+def parse_sample_rates(text):
+    """ Parses sample rates written as endpoint=rate,endpoint=rate """
+    rates = {}
+    for item in (text or '').split(','):
+        if '=' in item:
+            endpoint, rate = item.split('=', 1)
+            rates[endpoint.strip()] = float(rate)
+    return rates
+
+def start_queue_logging(handlers, size=10000):
+    """ Returns a queue handler and the started listener that feeds the handlers """
+    log_queue = queue.Queue(size)
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return QueueLogHandler(log_queue), listener
+
+def log_access(response, timer, endpoint):
+    """ Writes one JSON line with the outcome and timing of the request """
+    if not access_logger.isEnabledFor(logging.INFO):
+        return
+    entry = {'method': request.method,
+             'path': request.path,
+             'endpoint': endpoint,
+             'status': response.status_code,
+             'bytes': response.calculate_content_length()}
+    if timer is not None:
+        entry['duration_ms'] = round(timer.elapsed() * 1000, 2)
+        entry['db_ms'] = round(timer.db_time * 1000, 2)
+        entry['queries'] = timer.queries
+    access_logger.info(json.dumps(entry, separators=(',', ':')))
@@ -0,0 +1,172 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Request Metrics
+
+This module keeps Prometheus metrics for every Flask endpoint:
+
+http_requests_total - requests by method, endpoint and status
+http_request_duration_seconds - latency histogram by method and endpoint
+http_request_db_seconds - time spent in database queries by endpoint
+
+Each response also carries the number of queries it ran and where its
+time went in the X-DB-Query-Count and Server-Timing headers, and queries
+slower than SLOW_QUERY_THRESHOLD are logged with their parameters and the
+endpoint that ran them.
+
+When PROMETHEUS_MULTIPROC_DIR is set, each gunicorn worker writes its
+values to files in that directory and /metrics adds them all up, so any
+worker can answer the scrape. The directory must be emptied before the
+server starts and dead workers are removed with mark_process_dead().
+"""
+import os
+import time
+import logging
+from flask import g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from prometheus_client import Counter, Histogram, CollectorRegistry
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST, multiprocess
+
+# Latency buckets in seconds, from a cached page to a slow bulk request
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUEST_COUNT = Counter('http_requests_total', 'HTTP requests',
+                        ['method', 'endpoint', 'status'])
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'HTTP request latency',
+                            ['method', 'endpoint'], buckets=BUCKETS)
+REQUEST_DB_TIME = Histogram('http_request_db_seconds', 'Database time per HTTP request',
+                            ['endpoint'], buckets=BUCKETS)
+
+
+logger = logging.getLogger(__name__)
+
+# Labelled children by label values, looked up once instead of per request
+_children = {}
+
+# Any other method is labelled 'other' so clients can't add label values at will
+METHODS = frozenset(['GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'HEAD', 'OPTIONS'])
+
+def get_children(method, endpoint, status_code):
+    """ Returns the count, latency and db time metrics for a set of labels """
+    if method not in METHODS:
+        method = 'other'
+    key = (method, endpoint, status_code)
+    children = _children.get(key)
+    if children is None:
+        children = (REQUEST_COUNT.labels(method, endpoint, str(status_code)),
+                    REQUEST_LATENCY.labels(method, endpoint),
+                    REQUEST_DB_TIME.labels(endpoint))
+        _children[key] = children
+    return children
+
+class RequestTimer(object):
+    """ Clocks and query count of one request, kept in flask.g as a single lookup """
+    __slots__ = ('start', 'endpoint', 'slow_threshold', 'queries', 'db_time')
+
+    def __init__(self, endpoint=None, slow_threshold=None):
+        self.start = time.perf_counter()
+        self.endpoint = endpoint
+        self.slow_threshold = slow_threshold
+        self.queries = 0
+        self.db_time = 0.0
+
+    def elapsed(self):
+        """ Returns the seconds since the request started """
+        return time.perf_counter() - self.start
+
+    def server_timing(self):
+        """ Returns the Server-Timing header value in milliseconds """
+        total = self.elapsed() * 1000
+        return 'db;dur={:.1f}, app;dur={:.1f}'.format(self.db_time * 1000,
+                                                    total - self.db_time * 1000)
+
+class QueryCounter(object):
+    """
+    Counts the queries run inside a with block
+
+        with QueryCounter() as counter:
+            client.get('/pets')
+        assert counter.count <= 2
+    """
+    active = []
+
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+    def __enter__(self):
+        QueryCounter.active.append(self)
+        return self
+
+    def __exit__(self, *args):
+        QueryCounter.active.remove(self)
+
+def start_request(endpoint=None, slow_threshold=None):
+    """ Starts the clocks for the current request """
+    g.request_timer = RequestTimer(endpoint, slow_threshold)
+
+def finish_request(method, endpoint, status_code):
+    """ Records the metrics of the current request and returns its timer """
+    timer = g.get('request_timer')
+    if timer is None:
+        return None
+    count, latency, db_time = get_children(method, endpoint or 'none', status_code)
+    count.inc()
+    latency.observe(timer.elapsed())
+    db_time.observe(timer.db_time)
+    return timer
+
+def generate_metrics():
+    """ Returns the text exposition of the metrics and its content type """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+def mark_process_dead(pid):
+    """ Removes the live values of a worker that has exited """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.mark_process_dead(pid)
+
+
+######################################################################
+#  D A T A B A S E   E V E N T S
+######################################################################
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=unused-argument,too-many-arguments
+    """ Notes when a query started """
+    conn.info['query_start'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def finish_query(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=unused-argument,too-many-arguments
+    """ Adds a query and its time to the current request """
+    start = conn.info.pop('query_start', None)
+    for counter in QueryCounter.active:
+        counter.count += 1
+        counter.statements.append(statement)
+    if start is None or not has_app_context():
+        return
+    timer = g.get('request_timer')
+    if timer is None:
+        return
+    elapsed = time.perf_counter() - start
+    timer.queries += 1
+    timer.db_time += elapsed
+    if timer.slow_threshold is not None and elapsed > timer.slow_threshold:
+        logger.warning('Slow query in %s took %.3fs: %s %r',
+                       timer.endpoint, elapsed, statement, parameters)
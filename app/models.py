@@ -19,7 +19,17 @@ This model uses SQLAlchemy to persist itself
 """
 import os
 import json
+import time
+import sqlite3
 import logging
+import threading
+from collections import OrderedDict
+from sqlalchemy import event, func, case, cast, literal, literal_column, select, DDL
+from sqlalchemy.sql import table, column
+from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.inspection import inspect
+from sqlalchemy.exc import IntegrityError
 from . import db
 
 ######################################################################
@@ -28,6 +38,192 @@ from . import db
 class DataValidationError(ValueError):
     pass
 
+def is_integer(value):
+    """ Returns True if value is an int, not a bool, that fits an INTEGER column """
+    return isinstance(value, int) and not isinstance(value, bool) and \
+        -2 ** 31 <= value < 2 ** 31
+
+######################################################################
+# Single row updates
+######################################################################
+def execute_update(statement, columns, key):
+    """
+    Runs an UPDATE of the row matching key and returns its new columns
+
+    PostgreSQL returns them from the UPDATE itself. Other databases read
+    the row back in the same transaction, but only when a row was updated.
+    Returns None when the UPDATE matched no row.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        return db.session.execute(statement.returning(*columns)).first()
+    if db.session.execute(statement).rowcount:
+        return db.session.execute(select(*columns).where(key)).first()
+    return None
+
+def begin_write():
+    """
+    Takes the SQLite write lock before a transaction reads what it changes
+
+    SQLite has no FOR UPDATE and pysqlite only begins a transaction at the
+    first write, so another connection could commit between the read and
+    the write. Other databases lock the rows they read FOR UPDATE.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return
+    connection = db.session.connection()
+    if not connection.connection.dbapi_connection.in_transaction:
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+######################################################################
+# Change Counter for each table
+######################################################################
+class ChangeCounter(db.Model):
+    """
+    Generation number of a table that every write bumps
+
+    Collections are versioned by the generation of the tables they are
+    read from, so a client can find out that a list hasn't changed with a
+    single primary key lookup instead of running the list query.
+
+    A writer only marks the tables it changed. Their generations are
+    bumped by one short statement after its transaction commits, so the
+    writers don't queue on the counter row while their transactions run,
+    and a rolled back write bumps nothing. A reader that runs between the
+    commit and the bump can only cache newer rows under the old etag.
+    """
+    logger = logging.getLogger(__name__)
+
+    # Table Schema
+    name = db.Column(db.String(64), primary_key=True)
+    generation = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def bump(cls, name):
+        """ Bumps the generation of a table once the current transaction commits """
+        db.session.info.setdefault('changed_tables', set()).add(name)
+
+    @classmethod
+    def bump_now(cls, names):
+        """ Increments the generations of tables in a transaction of their own """
+        table = cls.__table__
+        with db.engine.begin() as connection:
+            for name in sorted(names):
+                result = connection.execute(
+                    table.update().where(table.c.name == name)
+                    .values(generation=table.c.generation + 1))
+                if result.rowcount == 0:
+                    # a table missing from the seed rows; another writer may add it first
+                    try:
+                        with connection.begin_nested():
+                            connection.execute(table.insert().values(name=name, generation=1))
+                    except IntegrityError:
+                        connection.execute(
+                            table.update().where(table.c.name == name)
+                            .values(generation=table.c.generation + 1))
+
+    @classmethod
+    def generations(cls):
+        """ Returns the generation of every table by name """
+        return dict(db.session.query(ChangeCounter.name, ChangeCounter.generation))
+
+def _bump_changed_tables(session):
+    names = session.info.pop('changed_tables', None)
+    if names:
+        ChangeCounter.bump_now(names)
+
+def _forget_changed_tables(session):
+    session.info.pop('changed_tables', None)
+
+def _seed_change_counters(target, connection, **kw):   # pylint: disable=unused-argument
+    connection.execute(target.insert(), [{'name': 'category', 'generation': 0},
+                                         {'name': 'pet', 'generation': 0}])
+
+event.listen(db.session, 'after_commit', _bump_changed_tables)
+event.listen(db.session, 'after_rollback', _forget_changed_tables)
+event.listen(ChangeCounter.__table__, 'after_create', _seed_change_counters)
+
+######################################################################
+# Pet Counters for each Category
+######################################################################
+class PetCounter(db.Model):
+    """
+    Number of Pets and of available Pets in a Category
+
+    When STATS_COUNTERS is set every Pet write adds its change to these
+    rows in the writer's transaction, so the statistics are read from one
+    row per Category instead of counting every Pet. Run
+    flask rebuild-stats after turning it on to count the existing Pets.
+    """
+    logger = logging.getLogger(__name__)
+
+    # Table Schema
+    category_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    available = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def enabled(cls):
+        """ Returns True if the Pet writes keep the counters up to date """
+        return db.get_app().config.get('STATS_COUNTERS', False)
+
+    @classmethod
+    def add(cls, counts, sign=1):
+        """
+        Adds (category_id, available, count) rows to the counters
+
+        A sign of -1 takes them away. Each Category is changed with a
+        single UPDATE, and its row is created when it doesn't exist yet.
+        """
+        deltas = {}
+        for category_id, available, count in counts:
+            total, avail = deltas.get(category_id, (0, 0))
+            deltas[category_id] = (total + sign * count, avail + (sign * count if available else 0))
+        table = cls.__table__
+        for category_id, (total, avail) in sorted(deltas.items()):
+            if not total and not avail:
+                continue
+            result = db.session.execute(
+                table.update().where(table.c.category_id == category_id)
+                .values(total=table.c.total + total, available=table.c.available + avail))
+            if result.rowcount == 0:
+                db.session.add(PetCounter(category_id=category_id, total=total, available=avail))
+
+    @classmethod
+    def add_pet(cls, pet):
+        """ Adds the change a Pet is about to save to the counters """
+        state = inspect(pet)
+        if state.transient or state.pending:
+            cls.add([(pet.category_id, pet.available, 1)])
+            return
+        category = state.attrs.category_id.history
+        available = state.attrs.available.history
+        if not category.has_changes() and not available.has_changes():
+            return
+        with db.session.no_autoflush:
+            if (category.deleted or not category.has_changes()) and \
+               (available.deleted or not available.has_changes()):
+                old = (category.deleted[0] if category.deleted else pet.category_id,
+                       available.deleted[0] if available.deleted else pet.available)
+            else:
+                # the old values were expired by a commit, read them back
+                old = db.session.query(Pet.category_id, Pet.available) \
+                                .filter(Pet.id == pet.id).one()
+        cls.add([(old[0], old[1], -1), (pet.category_id, pet.available, 1)])
+
+    @classmethod
+    def counts(cls):
+        """ Returns the (total, available) Pets of each Category by id """
+        return dict((row.category_id, (row.total, row.available))
+                    for row in db.session.query(cls.category_id, cls.total, cls.available))
+
+    @classmethod
+    def rebuild(cls):
+        """ Counts every Pet again """
+        cls.logger.info('Rebuilding the Pet counters')
+        cls.query.delete()
+        cls.add(Pet.count_by_category(Pet.query))
+        db.session.commit()
+
 class Category(db.Model):
     """ Category of Pet """
     logger = logging.getLogger(__name__)
@@ -36,7 +232,12 @@ class Category(db.Model):
     #__tablename__ = 'category'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), nullable=False)
-    members = db.relationship("Pet")
+    version = db.Column(db.Integer, nullable=False, default=1)
+    # the database deletes the member Pets through ON DELETE CASCADE
+    members = db.relationship("Pet", backref="category", order_by="Pet.id",
+                              cascade="all, delete", passive_deletes=True)
+    # every UPDATE and DELETE checks and bumps the version it loaded
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self):
         return '<Category %r>' % (self.name)
@@ -46,17 +247,53 @@ class Category(db.Model):
         # if the id is None it hasn't been added to the database
         if not self.id:
             db.session.add(self)
+        ChangeCounter.bump(Category.__tablename__)
         db.session.commit()
+        Category.get_cache().invalidate()
 
     def delete(self):
         """ Deletes a Category from the database """
         db.session.delete(self)
+        if PetCounter.enabled():
+            PetCounter.query.filter(PetCounter.category_id == self.id).delete()
+        ChangeCounter.bump(Category.__tablename__)
+        ChangeCounter.bump(Pet.__tablename__)
         db.session.commit()
+        Category.get_cache().invalidate()
+
+    @classmethod
+    def delete_by_id(cls, category_id, versions=None):
+        """
+        Deletes one Category and its Pets with a single DELETE statement
 
-    def serialize(self):
-        """ serializes a Category into a dictionary """
-        return {"id": self.id,
+        The Pets go through ON DELETE CASCADE in the database, so none of
+        them are loaded. When versions is given the Category is only deleted
+        if its version is one of them. Returns the number of Categories
+        that were deleted.
+        """
+        cls.logger.info('Processing delete of category %s ...', category_id)
+        query = cls.query.filter(cls.id == category_id)
+        if versions is not None:
+            query = query.filter(cls.version.in_(versions))
+        count = query.delete(synchronize_session=False)
+        if not count:
+            db.session.rollback()
+            return 0
+        if PetCounter.enabled():
+            PetCounter.query.filter(PetCounter.category_id == category_id).delete()
+        ChangeCounter.bump(cls.__tablename__)
+        ChangeCounter.bump(Pet.__tablename__)
+        db.session.commit()
+        cls.get_cache().invalidate()
+        return count
+
+    def serialize(self, members=False):
+        """ serializes a Category and optionally its member Pets into a dictionary """
+        data = {"id": self.id,
                 "name": self.name}
+        if members:
+            data["members"] = [pet.serialize() for pet in self.members]
+        return data
 
     def deserialize(self, data):
         """ deserializes a Category my marshalling the data """
@@ -69,6 +306,52 @@ class Category(db.Model):
                                       'bad or no data')
         return self
 
+    @classmethod
+    def deserialize_fields(cls, data):
+        """ Validates a partial Category and returns the column values it sets """
+        if not isinstance(data, dict):
+            raise DataValidationError('Invalid Category: body of request contained' \
+                                      'bad or no data')
+        values = {}
+        if 'name' in data:
+            if (not isinstance(data['name'], str) or not data['name']
+                    or len(data['name']) > cls.name.type.length):
+                raise DataValidationError('Invalid Category: bad name')
+            values['name'] = data['name']
+        if not values:
+            raise DataValidationError('Invalid Category: no fields to update')
+        return values
+
+    @classmethod
+    def update_fields(cls, category_id, values, versions=None):
+        """
+        Sets the columns in values on one Category with a single UPDATE
+
+        Works like Pet.update_fields() and returns the row of the updated
+        Category with its new version, or None if no Category matched.
+        """
+        cls.logger.info('Processing update of category %s with %s ...', category_id, values)
+        table = cls.__table__
+        key = table.c.id == category_id
+        statement = table.update().where(key)
+        if versions is not None:
+            statement = statement.where(table.c.version.in_(versions))
+        statement = statement.values(version=table.c.version + 1, **values)
+        columns = [table.c[column.key] for column in cls.row_columns()] + [table.c.version]
+        row = execute_update(statement, columns, key)
+        if row is None:
+            db.session.rollback()
+            return None
+        ChangeCounter.bump(cls.__tablename__)
+        db.session.commit()
+        cls.get_cache().invalidate()
+        return row
+
+    @classmethod
+    def get_cache(cls):
+        """ Returns the Category cache of the current app """
+        return db.get_app().extensions['category_cache']
+
     @classmethod
     def init_db(cls):
         """ Initializes the database session """
@@ -78,19 +361,66 @@ class Category(db.Model):
     @classmethod
     def delete_all(cls):
         cls.query.delete()
+        if PetCounter.enabled():
+            PetCounter.query.delete()
+        ChangeCounter.bump(cls.__tablename__)
+        ChangeCounter.bump(Pet.__tablename__)
         db.session.commit()
+        cls.get_cache().invalidate()
 
     @classmethod
     def all(cls):
         """ Return all of the Categories in the database """
         cls.logger.info('Processing all Categories')
-        return cls.query.all()
+        return [db.session.merge(category, load=False)
+                for category in cls.get_cache().get().values()]
+
+    @classmethod
+    def choices(cls):
+        """ Return the (id, name) choices for a Category select field """
+        return [(category.id, category.name) for category in cls.get_cache().get().values()]
 
     @classmethod
-    def find(cls, category_id):
+    def find(cls, category_id, cached=True):
         """ Find a Category by it's id """
         cls.logger.info('Processing category lookup for id %s ...', category_id)
-        return cls.query.get(category_id)
+        if not cached:
+            # writers need the current version, not the one in the cache
+            return cls.query.get(category_id)
+        try:
+            category = cls.get_cache().get().get(int(category_id))
+        except (TypeError, ValueError):
+            category = None
+        if category is None:
+            # it may have been created since the cache was loaded
+            return cls.query.get(category_id)
+        return db.session.merge(category, load=False)
+
+    @classmethod
+    def find_version(cls, category_id):
+        """ Returns the version of a Category without loading it or None """
+        return db.session.query(Category.version).filter(Category.id == category_id).scalar()
+
+    @classmethod
+    def find_with_members(cls, category_id):
+        """ Find a Category by it's id and load its member Pets in one more query """
+        cls.logger.info('Processing category lookup with members for id %s ...', category_id)
+        return cls.with_members(cls.query).filter(Category.id == category_id).first()
+
+    @classmethod
+    def row_columns(cls):
+        """ Returns the columns that serialize() reads """
+        return [Category.id, Category.name]
+
+    @classmethod
+    def as_rows(cls, query):
+        """ Selects just the serialized columns of a query as plain rows """
+        return query.with_entities(*cls.row_columns())
+
+    @classmethod
+    def with_members(cls, query):
+        """ Loads the member Pets of every Category in a query with one more query """
+        return query.options(db.selectinload(Category.members))
 
     @classmethod
     def find_or_404(cls, category_id):
@@ -98,12 +428,109 @@ class Category(db.Model):
         cls.logger.info('Processing category lookup or 404 for id %s ...', category_id)
         return cls.query.get_or_404(category_id)
 
+    @classmethod
+    def find_ids(cls, category_ids):
+        """ Returns the subset of the given ids that belong to a Category """
+        cls.logger.info('Processing category id lookup for %d ids ...', len(category_ids))
+        if not category_ids:
+            return set()
+        query = db.session.query(Category.id).filter(Category.id.in_(category_ids))
+        return set(row.id for row in query)
+
     @classmethod
     def find_by_name(cls, name):
         """ Query that finds Categories by their name """
         cls.logger.info('Processing category name query for %s ...', name)
         return cls.query.filter(Category.name == name)
 
+    @classmethod
+    def stats(cls):
+        """
+        Returns the total, available and sold Pets of every Category
+
+        The Categories are joined to their counts in the same query, not
+        read from the cache, so the statistics always match the table
+        generations in their etag.
+        """
+        cls.logger.info('Processing category statistics')
+        if PetCounter.enabled():
+            query = db.session.query(Category.id, Category.name,
+                                     func.coalesce(PetCounter.total, 0),
+                                     func.coalesce(PetCounter.available, 0)) \
+                              .outerjoin(PetCounter, PetCounter.category_id == Category.id)
+        else:
+            query = db.session.query(Category.id, Category.name, func.count(Pet.id),
+                                     func.coalesce(func.sum(case([(Pet.available, 1)], else_=0)), 0)) \
+                              .outerjoin(Pet, Pet.category_id == Category.id) \
+                              .group_by(Category.id, Category.name)
+        return [{'id': category_id,
+                 'name': name,
+                 'total': total,
+                 'available': available,
+                 'sold': total - available}
+                for category_id, name, total, available in query.order_by(Category.id)]
+
+
+######################################################################
+# Category Cache
+######################################################################
+class CategoryCache(object):
+    """
+    In-process cache of all of the Categories
+
+    Categories rarely change but are read on every page load and Pet form
+    post, so they are kept in memory for CATEGORY_CACHE_TTL seconds and
+    dropped whenever a Category is saved or deleted. The cache holds
+    detached copies that are merged into the current session without a
+    query, so callers get ordinary Category instances they can update.
+    """
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._categories = None
+        self._expires = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get_ttl(self):
+        """ Returns the time to live from the app config or the default """
+        return db.get_app().config.get('CATEGORY_CACHE_TTL', self.ttl)
+
+    def get(self):
+        """ Returns the cached Categories by id, loading them on a miss """
+        categories = self._categories
+        if categories is not None and time.time() < self._expires:
+            self.hits += 1
+            return categories
+        self.misses += 1
+        generation = self._generation
+        keys = [column.key for column in Category.__table__.columns]
+        rows = db.session.query(*[getattr(Category, key) for key in keys]).order_by(Category.id)
+        categories = OrderedDict()
+        for row in rows:
+            category = Category(**dict(zip(keys, row)))
+            make_transient_to_detached(category)
+            categories[category.id] = category
+        with self._lock:
+            # don't keep the rows if a write invalidated the cache meanwhile
+            if generation == self._generation:
+                self._categories = categories
+                self._expires = time.time() + self.get_ttl()
+        return categories
+
+    def invalidate(self):
+        """ Drops the cached Categories so the next read reloads them """
+        with self._lock:
+            self._generation += 1
+            self._categories = None
+
+    def stats(self):
+        """ Returns the hit and miss counters of the cache """
+        categories = self._categories
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'size': len(categories) if categories is not None else 0}
 
 
 ######################################################################
@@ -115,31 +542,49 @@ class Pet(db.Model):
 
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(63), nullable=False)
-    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
+    name = db.Column(db.String(63), nullable=False, index=True)
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id', ondelete='CASCADE'),
+                            nullable=False, index=True)
     available = db.Column(db.Boolean())
+    version = db.Column(db.Integer, nullable=False, default=1)
+    __table_args__ = (
+        db.Index('ix_pet_category_id_available', 'category_id', 'available'),
+    )
+    # every UPDATE and DELETE checks and bumps the version it loaded
+    __mapper_args__ = {'version_id_col': version}
 
     def __repr__(self):
         return '<Pet %r>' % (self.name)
 
     def save(self):
         """ Saves an existing Pet in the database """
+        if PetCounter.enabled():
+            # before reading the id, which may flush the changes it looks at
+            PetCounter.add_pet(self)
         # if the id is None it hasn't been added to the database
         if not self.id:
             db.session.add(self)
+        ChangeCounter.bump(Pet.__tablename__)
         db.session.commit()
 
     def delete(self):
         """ Deletes a Pet from the database """
+        # read the counts first, loading them later would flush the DELETE
+        counts = [(self.category_id, self.available, 1)] if PetCounter.enabled() else []
         db.session.delete(self)
+        PetCounter.add(counts, sign=-1)
+        ChangeCounter.bump(Pet.__tablename__)
         db.session.commit()
 
-    def serialize(self):
-        """ serializes a Pet into a dictionary """
-        return {"id": self.id,
+    def serialize(self, category=False):
+        """ serializes a Pet and optionally its Category name into a dictionary """
+        data = {"id": self.id,
                 "name": self.name,
                 "category_id": self.category_id,
                 "available": self.available}
+        if category:
+            data["category"] = self.category.name
+        return data
 
     def deserialize(self, data):
         """ deserializes a Pet my marshalling the data """
@@ -154,6 +599,35 @@ class Pet(db.Model):
                                       'bad or no data')
         return self
 
+    @classmethod
+    def deserialize_fields(cls, data):
+        """
+        Validates a partial Pet and returns the column values it sets
+
+        Only the fields that are present are checked, so this can be used to
+        build an UPDATE without loading the Pets first.
+        """
+        if not isinstance(data, dict):
+            raise DataValidationError('Invalid pet: body of request contained' \
+                                      'bad or no data')
+        values = {}
+        if 'name' in data:
+            if (not isinstance(data['name'], str) or not data['name']
+                    or len(data['name']) > cls.name.type.length):
+                raise DataValidationError('Invalid pet: bad name')
+            values['name'] = data['name']
+        if 'category_id' in data:
+            if not is_integer(data['category_id']):
+                raise DataValidationError('Invalid pet: bad category_id')
+            values['category_id'] = data['category_id']
+        if 'available' in data:
+            if not isinstance(data['available'], bool):
+                raise DataValidationError('Invalid pet: bad available')
+            values['available'] = data['available']
+        if not values:
+            raise DataValidationError('Invalid pet: no fields to update')
+        return values
+
     @classmethod
     def init_db(cls):
         """ Initializes the database session """
@@ -163,6 +637,9 @@ class Pet(db.Model):
     @classmethod
     def delete_all(cls):
         cls.query.delete()
+        if PetCounter.enabled():
+            PetCounter.query.delete()
+        ChangeCounter.bump(cls.__tablename__)
         db.session.commit()
 
     @classmethod
@@ -183,6 +660,11 @@ class Pet(db.Model):
         cls.logger.info('Processing lookup for id %s ...', pet_id)
         return Pet.query.get(pet_id)
 
+    @classmethod
+    def find_version(cls, pet_id):
+        """ Returns the version of a Pet without loading it or None """
+        return db.session.query(Pet.version).filter(Pet.id == pet_id).scalar()
+
     @classmethod
     def find_or_404(cls, pet_id):
         """ Find a Pet by it's id """
@@ -206,3 +688,341 @@ class Pet(db.Model):
         """ Query that finds Pets by their availability """
         cls.logger.info('Processing available query for %s ...', available)
         return Pet.query.filter(Pet.available == available)
+
+    @classmethod
+    def count_by_category(cls, query):
+        """ Returns (category_id, available, count) rows for the Pets of a query """
+        return query.with_entities(Pet.category_id, Pet.available, func.count()) \
+                    .group_by(Pet.category_id, Pet.available).all()
+
+    @classmethod
+    def counts(cls):
+        """
+        Returns the (total, available) Pets of each Category by id
+
+        They are read from the PetCounter rows when STATS_COUNTERS is set
+        and counted with a GROUP BY on the category and availability index
+        otherwise.
+        """
+        if PetCounter.enabled():
+            return PetCounter.counts()
+        counts = {}
+        for category_id, available, count in cls.count_by_category(Pet.query):
+            total, avail = counts.get(category_id, (0, 0))
+            counts[category_id] = (total + count, avail + (count if available else 0))
+        return counts
+
+    @classmethod
+    def stats(cls):
+        """ Returns the total, available and sold Pets """
+        cls.logger.info('Processing pet statistics')
+        total = available = 0
+        for category_total, category_available in cls.counts().values():
+            total += category_total
+            available += category_available
+        return {'total': total, 'available': available, 'sold': total - available}
+
+    @classmethod
+    def row_columns(cls):
+        """ Returns the columns that serialize() reads """
+        return [Pet.id, Pet.name, Pet.category_id, Pet.available]
+
+    @classmethod
+    def as_rows(cls, query, category=False):
+        """
+        Selects just the serialized columns of a query as plain rows
+
+        The rows skip building Pet instances and the identity map, and
+        row._asdict() has the same keys and values as serialize().
+        """
+        columns = cls.row_columns()
+        if category:
+            query = query.join(Pet.category)
+            columns.append(Category.name.label('category'))
+        return query.with_entities(*columns)
+
+    @classmethod
+    def search(cls, text):
+        """
+        Query of the Pets whose name starts with or resembles the text
+
+        Returns the query of plain rows and its rank column. A lower rank is
+        a better match: names that start with the text come first, followed
+        by the names that share the most trigrams with it, so a typo still
+        finds the Pet. PostgreSQL matches with the pg_trgm % operator and
+        SQLite with the pet_search FTS5 table, both backed by an index.
+        """
+        cls.logger.info('Processing search for %s ...', text)
+        text = text.lower()
+        prefix = func.lower(Pet.name).like(escape_like(text) + '%', escape='\\')
+        not_prefix = case([(prefix, 0)], else_=1)
+        dialect = db.engine.dialect.name
+        if dialect == 'postgresql':
+            query = Pet.query.filter(prefix | Pet.name.op('%')(text))
+            # similarity() is a real; as a double the rank round-trips through the cursor
+            rank = not_prefix + 1 - cast(func.similarity(Pet.name, text), DOUBLE_PRECISION)
+        elif dialect == 'sqlite' and len(text) >= 3 and has_trigram_search():
+            search = literal_column(PET_SEARCH.name)
+            query = Pet.query.join(PET_SEARCH, PET_SEARCH.c.rowid == Pet.id) \
+                             .filter(search.op('MATCH')(trigram_query(text)))
+            # bm25 is negative and lower for better matches
+            rank = not_prefix + 1.0 / (1.0 - func.bm25(search))
+        else:
+            query = Pet.query.filter(prefix)
+            rank = literal(0)
+        rank = rank.label('rank')
+        return query.with_entities(*(cls.row_columns() + [rank])), rank
+
+    @classmethod
+    def bulk_insert(cls, pets, batch_size=1000):
+        """
+        Inserts a list of new Pets in batches and returns their ids
+
+        On PostgreSQL each batch is a single multi-row INSERT ... RETURNING.
+        Other databases insert the rows one statement at a time so that the
+        ids can be read back, but still in a single transaction.
+        """
+        cls.logger.info('Processing bulk insert of %d Pets ...', len(pets))
+        ids = []
+        if db.engine.dialect.name == 'postgresql':
+            for start in range(0, len(pets), batch_size):
+                rows = [{'name': pet.name,
+                         'category_id': pet.category_id,
+                         'available': pet.available}
+                        for pet in pets[start:start + batch_size]]
+                statement = Pet.__table__.insert().values(rows).returning(Pet.id)
+                ids.extend(row[0] for row in db.session.execute(statement))
+        else:
+            for start in range(0, len(pets), batch_size):
+                batch = pets[start:start + batch_size]
+                db.session.bulk_save_objects(batch, return_defaults=True)
+                ids.extend(pet.id for pet in batch)
+        if PetCounter.enabled():
+            PetCounter.add((pet.category_id, pet.available, 1) for pet in pets)
+        ChangeCounter.bump(cls.__tablename__)
+        db.session.commit()
+        return ids
+
+    @classmethod
+    def purchase(cls, pet_id):
+        """
+        Marks an available Pet as sold and returns its row
+
+        The check and the change are one conditional UPDATE, so when many
+        buyers race for the same Pet exactly one of them gets it, without
+        locking or reading the row first. Returns None if the Pet is not
+        available or doesn't exist. The row has the serialized columns and
+        the new version.
+        """
+        cls.logger.info('Processing purchase of %s ...', pet_id)
+        table = cls.__table__
+        statement = table.update() \
+                         .where(table.c.id == pet_id) \
+                         .where(table.c.available) \
+                         .values(available=False, version=table.c.version + 1)
+        columns = [table.c[column.key] for column in cls.row_columns()] + [table.c.version]
+        row = execute_update(statement, columns, table.c.id == pet_id)
+        if row is None:
+            db.session.rollback()
+            return None
+        if PetCounter.enabled():
+            PetCounter.add([(row.category_id, True, -1), (row.category_id, False, 1)])
+        ChangeCounter.bump(cls.__tablename__)
+        db.session.commit()
+        return row
+
+    @classmethod
+    def update_fields(cls, pet_id, values, versions=None):
+        """
+        Sets the columns in values on one Pet with a single UPDATE
+
+        values comes from deserialize_fields(). When versions is given the
+        Pet is only updated if its version is one of them. Returns the row
+        of the updated Pet like purchase() does, or None if no Pet matched.
+        """
+        cls.logger.info('Processing update of %s with %s ...', pet_id, values)
+        table = cls.__table__
+        key = table.c.id == pet_id
+        statement = table.update().where(key)
+        if versions is not None:
+            statement = statement.where(table.c.version.in_(versions))
+        statement = statement.values(version=table.c.version + 1, **values)
+        old = None
+        if PetCounter.enabled() and ('category_id' in values or 'available' in values):
+            # lock the row so its old counts can't change before the UPDATE
+            begin_write()
+            old = db.session.query(Pet.category_id, Pet.available) \
+                            .filter(Pet.id == pet_id).with_for_update().first()
+        columns = [table.c[column.key] for column in cls.row_columns()] + [table.c.version]
+        row = execute_update(statement, columns, key)
+        if row is None:
+            db.session.rollback()
+            return None
+        if old is not None:
+            PetCounter.add([(old.category_id, old.available, -1),
+                            (row.category_id, row.available, 1)])
+        ChangeCounter.bump(cls.__tablename__)
+        db.session.commit()
+        return row
+
+    @classmethod
+    def find_by_filters(cls, **filters):
+        """ Query that finds Pets matching all of the filters that are not None """
+        cls.logger.info('Processing filter query for %s ...', filters)
+        return Pet.query.filter(*cls.filter_criteria(**filters))
+
+    @classmethod
+    def filter_criteria(cls, ids=None, category=None, name=None, available=None):
+        """ Returns the WHERE criteria for the filters that are not None """
+        criteria = []
+        if ids is not None:
+            criteria.append(Pet.id.in_(ids))
+        if category is not None:
+            criteria.append(Pet.category_id == category)
+        if name is not None:
+            criteria.append(Pet.name == name)
+        if available is not None:
+            criteria.append(Pet.available == available)
+        return criteria
+
+    @classmethod
+    def update_by_filters(cls, values, **filters):
+        """
+        Updates every Pet matching the filters with one UPDATE statement
+
+        Returns the number of Pets that were updated. No Pets are loaded, so
+        Pets already in the session are not refreshed.
+        """
+        cls.logger.info('Processing bulk update of %s ...', values)
+        new_values = dict(values, version=Pet.version + 1)
+        if PetCounter.enabled() and ('category_id' in values or 'available' in values):
+            # move the updated Pets from their old counts to their new ones
+            count, counts = cls.change_counted(cls.filter_criteria(**filters), new_values)
+            PetCounter.add(counts, sign=-1)
+            PetCounter.add((values.get('category_id', category_id),
+                            values.get('available', available), count)
+                           for category_id, available, count in counts)
+        else:
+            count = cls.find_by_filters(**filters).update(new_values, synchronize_session=False)
+        ChangeCounter.bump(cls.__tablename__)
+        db.session.commit()
+        return count
+
+    @classmethod
+    def delete_by_filters(cls, **filters):
+        """ Deletes every Pet matching the filters with one DELETE statement """
+        cls.logger.info('Processing bulk delete ...')
+        if PetCounter.enabled():
+            count, counts = cls.change_counted(cls.filter_criteria(**filters))
+            PetCounter.add(counts, sign=-1)
+        else:
+            count = cls.find_by_filters(**filters).delete(synchronize_session=False)
+        ChangeCounter.bump(cls.__tablename__)
+        db.session.commit()
+        return count
+
+    @classmethod
+    def delete_by_id(cls, pet_id, versions=None):
+        """
+        Deletes one Pet with a single DELETE statement
+
+        When versions is given the Pet is only deleted if its version is one
+        of them. Returns the number of Pets that were deleted.
+        """
+        cls.logger.info('Processing delete of %s ...', pet_id)
+        criteria = [Pet.id == pet_id]
+        if versions is not None:
+            criteria.append(Pet.version.in_(versions))
+        if PetCounter.enabled():
+            count, counts = cls.change_counted(criteria)
+            PetCounter.add(counts, sign=-1)
+        else:
+            count = cls.query.filter(*criteria).delete(synchronize_session=False)
+        if not count:
+            db.session.rollback()
+            return 0
+        ChangeCounter.bump(cls.__tablename__)
+        db.session.commit()
+        return count
+
+    @classmethod
+    def change_counted(cls, criteria, values=None):
+        """
+        Updates the Pets matching criteria with values, or deletes them
+
+        Returns the number of Pets changed and the (category_id, available,
+        count) rows they had before, for the counters. PostgreSQL returns
+        the old rows from the statement itself, reading them from a FOR
+        UPDATE subquery, so a concurrent write can't slip in between. Other
+        databases count the Pets first under the SQLite write lock.
+        """
+        table = cls.__table__
+        if db.engine.dialect.name == 'postgresql':
+            if values is None:
+                statement = table.delete().where(*criteria) \
+                                 .returning(table.c.category_id, table.c.available)
+            else:
+                old = select(table.c.id, table.c.category_id, table.c.available) \
+                      .where(*criteria).with_for_update().subquery('old')
+                statement = table.update().where(table.c.id == old.c.id).values(values) \
+                                 .returning(old.c.category_id, old.c.available)
+            changed = statement.cte('changed')
+            counts = db.session.execute(
+                select(changed.c.category_id, changed.c.available, func.count())
+                .group_by(changed.c.category_id, changed.c.available)).fetchall()
+            return sum(count for _, _, count in counts), counts
+        begin_write()
+        counts = cls.count_by_category(cls.query.filter(*criteria))
+        query = cls.query.filter(*criteria)
+        if values is None:
+            return query.delete(synchronize_session=False), counts
+        return query.update(values, synchronize_session=False), counts
+
+
+######################################################################
+# Name search index
+######################################################################
+# External content FTS5 table over pet.name that the triggers keep in sync
+PET_SEARCH = table('pet_search', column('rowid'), column('name'))
+
+PET_SEARCH_DDL = {
+    'sqlite': [
+        "CREATE VIRTUAL TABLE pet_search USING fts5("
+        "name, content='pet', content_rowid='id', tokenize='trigram')",
+        "CREATE TRIGGER pet_search_insert AFTER INSERT ON pet BEGIN "
+        "INSERT INTO pet_search(rowid, name) VALUES (new.id, new.name); END",
+        "CREATE TRIGGER pet_search_delete AFTER DELETE ON pet BEGIN "
+        "INSERT INTO pet_search(pet_search, rowid, name) VALUES ('delete', old.id, old.name); END",
+        "CREATE TRIGGER pet_search_update AFTER UPDATE OF name ON pet BEGIN "
+        "INSERT INTO pet_search(pet_search, rowid, name) VALUES ('delete', old.id, old.name); "
+        "INSERT INTO pet_search(rowid, name) VALUES (new.id, new.name); END",
+    ],
+    'postgresql': [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX ix_pet_name_trgm ON pet USING gin (name gin_trgm_ops)",
+        "CREATE INDEX ix_pet_name_lower_pattern ON pet (lower(name) text_pattern_ops)",
+    ],
+}
+
+def has_trigram_search():
+    """ Returns True if SQLite has the FTS5 trigram tokenizer (3.34 and later) """
+    return sqlite3.sqlite_version_info >= (3, 34)
+
+def escape_like(text):
+    """ Escapes the LIKE wildcards in text """
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def trigram_query(text):
+    """ Returns an FTS5 query that matches any of the trigrams of the text """
+    trigrams = sorted(set(text[i:i + 3] for i in range(len(text) - 2)))
+    return ' OR '.join('"{}"'.format(trigram.replace('"', '""')) for trigram in trigrams)
+
+def _create_search_index(target, connection, **kw):   # pylint: disable=unused-argument
+    if connection.dialect.name == 'sqlite' and not has_trigram_search():
+        return
+    for statement in PET_SEARCH_DDL.get(connection.dialect.name, []):
+        connection.execute(DDL(statement))
+
+event.listen(Pet.__table__, 'after_create', _create_search_index)
+event.listen(Pet.__table__, 'before_drop',
+             DDL('DROP TABLE IF EXISTS pet_search').execute_if(dialect='sqlite'))
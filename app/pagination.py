@@ -0,0 +1,101 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Keyset Pagination
+
+This module pages through SQLAlchemy queries using the sort key of the
+last row returned instead of an OFFSET. Each page is an index range scan
+that starts where the previous page stopped, so the cost of a page does
+not grow with how deep into the table the client has walked.
+
+Cursors are opaque tokens that encode the key values of the last row.
+"""
+import json
+import base64
+from sqlalchemy import and_, or_, types
+from app.models import DataValidationError
+
+
+def encode_cursor(values):
+    """ Encodes a list of key values into an opaque cursor token """
+    data = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, columns):
+    """ Decodes a cursor token back into the key values of the columns """
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(cursor + padding))
+    except (ValueError, TypeError):
+        raise DataValidationError('Invalid cursor: {}'.format(cursor))
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise DataValidationError('Invalid cursor: {}'.format(cursor))
+    if not all(is_key_value(column, value) for column, value in zip(columns, values)):
+        raise DataValidationError('Invalid cursor: {}'.format(cursor))
+    return values
+
+def is_key_value(column, value):
+    """ Returns True if a decoded cursor value fits the type of its key column """
+    if value is None:
+        return True
+    if isinstance(column.type, types.Boolean):
+        return isinstance(value, bool)
+    if isinstance(value, bool):
+        return False
+    if isinstance(column.type, types.Integer):
+        return isinstance(value, int)
+    if isinstance(column.type, (types.Float, types.Numeric)):
+        return isinstance(value, (int, float))
+    if isinstance(column.type, types.String):
+        return isinstance(value, str)
+    return isinstance(value, (int, float, str))
+
+def keyset_filter(columns, values, descending=False):
+    """ Builds a WHERE clause that selects the rows after the key values """
+    # (a, b) > (x, y) is expanded to: a > x OR (a = x AND b > y)
+    clauses = []
+    for i, column in enumerate(columns):
+        after = column < values[i] if descending else column > values[i]
+        equal = [columns[j] == values[j] for j in range(i)]
+        clauses.append(and_(*(equal + [after])))
+    return or_(*clauses)
+
+def keyset_query(query, columns, cursor=None, descending=False):
+    """ Orders a query by the key columns and starts it after the cursor """
+    order = [column.desc() if descending else column.asc() for column in columns]
+    query = query.order_by(None).order_by(*order)
+    if cursor:
+        values = decode_cursor(cursor, columns)
+        query = query.filter(keyset_filter(columns, values, descending))
+    return query
+
+def paginate(query, columns, limit=None, cursor=None, descending=False):
+    """
+    Returns one page of a query and the cursor for the next page
+
+    The query is ordered by the key columns, which must end with a unique
+    column so that every row has a distinct position. When limit is None
+    all of the remaining rows are returned and the next cursor is None.
+    """
+    query = keyset_query(query, columns, cursor, descending)
+    if limit is None:
+        return query.all(), None
+    # fetch one extra row to find out if there is another page
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor([getattr(last, column.key) for column in columns])
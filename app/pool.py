@@ -0,0 +1,192 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Connection Pool
+
+This module applies the pool settings from DATABASE_POOL_OPTIONS and
+keeps live statistics about the pool of each worker process:
+
+checked_out - connections in use right now
+overflow - connections open above pool_size (QueuePool only)
+wait_time - seconds spent waiting for a connection to be checked out
+connect_time - seconds spent opening new database connections
+timeouts - checkouts that gave up after pool_timeout
+
+Slow checkouts and connects are logged as warnings so that a pool that
+is too small for the load shows up in the logs before it times out.
+"""
+import time
+import sqlite3
+import logging
+import threading
+import flask_sqlalchemy
+from sqlalchemy import event, orm
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import Pool, QueuePool
+from app.replicas import RoutingSession
+
+# Engine options that only apply to a QueuePool
+QUEUE_POOL_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout', 'poolclass')
+
+
+class PoolMetrics(object):
+    """ Counters for the connection pools of this process """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, slow_threshold=0.1):
+        self.slow_threshold = slow_threshold
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Sets every counter back to zero """
+        with self._lock:
+            self.checked_out = 0
+            self.checkouts = 0
+            self.timeouts = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+            self.connects = 0
+            self.connect_total = 0.0
+            self.connect_max = 0.0
+
+    def record_checkout(self):
+        """ Counts a connection handed out by a pool """
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+
+    def record_checkin(self):
+        """ Counts a connection given back to a pool """
+        with self._lock:
+            self.checked_out = max(self.checked_out - 1, 0)
+
+    def record_wait(self, seconds, timed_out=False):
+        """ Records the time a checkout waited for a connection """
+        with self._lock:
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+        if timed_out:
+            self.logger.error('Connection pool timed out after %.3fs with %d connections checked out',
+                              seconds, self.checked_out)
+        elif seconds > self.slow_threshold:
+            self.logger.warning('Waited %.3fs for a pooled connection with %d checked out',
+                                seconds, self.checked_out)
+
+    def record_connect(self, seconds):
+        """ Records the time it took to open a new database connection """
+        with self._lock:
+            self.connects += 1
+            self.connect_total += seconds
+            self.connect_max = max(self.connect_max, seconds)
+        if seconds > self.slow_threshold:
+            self.logger.warning('Opening a database connection took %.3fs', seconds)
+
+    def stats(self, pool=None):
+        """ Returns the counters along with the state of a pool """
+        with self._lock:
+            data = {
+                'checked_out': self.checked_out,
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_time': {'total': self.wait_total, 'max': self.wait_max},
+                'connects': self.connects,
+                'connect_time': {
+                    'total': self.connect_total,
+                    'max': self.connect_max,
+                    'avg': self.connect_total / self.connects if self.connects else 0.0
+                },
+            }
+        if pool is not None:
+            data['pool'] = type(pool).__name__
+            if isinstance(pool, QueuePool):
+                data['size'] = pool.size()
+                data['checked_in'] = pool.checkedin()
+                data['overflow'] = pool.overflow()
+        return data
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """ QueuePool that times how long each checkout waits for a connection """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super(InstrumentedQueuePool, self)._do_get()
+        except PoolTimeoutError:
+            pool_metrics.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        pool_metrics.record_wait(time.perf_counter() - start)
+        return connection
+
+
+class SQLAlchemy(flask_sqlalchemy.SQLAlchemy):
+    """
+    Flask-SQLAlchemy that uses the instrumented pool where it applies and
+    sends the queries of read-only requests to the read replicas
+    """
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_pool_defaults(self, app, options):
+        options = super(SQLAlchemy, self).apply_pool_defaults(app, options)
+        options.update(app.config.get('DATABASE_POOL_OPTIONS', {}))
+        return options
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        if sa_url.get_backend_name() == 'sqlite':
+            # SQLite connections are files, they don't need a QueuePool
+            for name in QUEUE_POOL_OPTIONS:
+                options.pop(name, None)
+        else:
+            options.setdefault('poolclass', InstrumentedQueuePool)
+        return super(SQLAlchemy, self).apply_driver_hacks(app, sa_url, options)
+
+
+######################################################################
+#  P O O L   E V E N T S
+######################################################################
+
+@event.listens_for(Engine, 'do_connect')
+def time_connect(dialect, conn_rec, cargs, cparams):   # pylint: disable=unused-argument
+    """ Opens a DBAPI connection and records how long it took """
+    start = time.perf_counter()
+    connection = dialect.connect(*cargs, **cparams)
+    pool_metrics.record_connect(time.perf_counter() - start)
+    return connection
+
+@event.listens_for(Pool, 'checkout')
+def count_checkout(dbapi_connection, connection_record, connection_proxy):  # pylint: disable=unused-argument
+    """ Counts a checkout from any pool """
+    pool_metrics.record_checkout()
+
+@event.listens_for(Pool, 'checkin')
+def count_checkin(dbapi_connection, connection_record):    # pylint: disable=unused-argument
+    """ Counts a checkin to any pool """
+    pool_metrics.record_checkin()
+
+@event.listens_for(Pool, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):   # pylint: disable=unused-argument
+    """ Makes SQLite enforce foreign keys, so ON DELETE CASCADE works like on PostgreSQL """
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
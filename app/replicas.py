@@ -0,0 +1,160 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Read Replicas
+
+Every replica URI in DATABASE_REPLICA_URIS becomes a bind named
+replica_0, replica_1, ... and the GET requests to the read-only
+endpoints send their queries to one of them in turn. Everything else
+stays on the primary:
+
+- writes, and any query of a request that is not read-only
+- reads by a client that wrote in the last READ_YOUR_WRITES_SECONDS, which
+  are marked by the cookie set on its write so they see their own changes
+- reads when no replica is healthy
+
+A replica is checked with SELECT 1 at most once every
+REPLICA_HEALTH_INTERVAL seconds, and one whose queries fail is taken
+out of the rotation until its next check succeeds.
+"""
+import time
+import logging
+import itertools
+import threading
+import flask_sqlalchemy
+from flask import g, request, current_app, has_request_context
+from sqlalchemy import event, text
+from sqlalchemy.exc import SQLAlchemyError, OperationalError
+
+# The endpoints whose GET requests can be served by a replica
+READ_ENDPOINTS = frozenset(['index', 'list_pets', 'search_pets', 'get_pets', 'pet_stats',
+                            'list_categories', 'get_categories', 'category_stats'])
+# Cookie holding the time until which a client that wrote reads from the primary
+PRIMARY_COOKIE = 'db_primary_until'
+
+
+class ReplicaRouter(object):
+    """ Picks a healthy replica for each read-only request """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, binds, check_interval=5.0):
+        self.binds = list(binds)
+        self.check_interval = check_interval
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+        self._health = {}       # bind -> (checked at, healthy)
+        self._watched = set()
+
+    def choose(self, db, app):
+        """ Returns the engine of the next healthy replica, or None for the primary """
+        if not self.binds:
+            return None
+        start = next(self._turn)
+        for offset in range(len(self.binds)):
+            bind = self.binds[(start + offset) % len(self.binds)]
+            engine = db.get_engine(app, bind=bind)
+            if self.is_healthy(bind, engine):
+                return engine
+        return None
+
+    def is_healthy(self, bind, engine):
+        """ Returns True if the replica answered its last health check """
+        with self._lock:
+            checked, healthy = self._health.get(bind, (None, False))
+            if checked is not None and time.monotonic() - checked < self.check_interval:
+                return healthy
+            # claim the check so other threads keep the old answer meanwhile
+            self._health[bind] = (time.monotonic(), healthy)
+            if bind not in self._watched:
+                event.listen(engine, 'handle_error', self._query_failed(bind))
+                self._watched.add(bind)
+        try:
+            with engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+        except SQLAlchemyError as error:
+            self.mark(bind, False, error)
+            return False
+        self.mark(bind, True)
+        return True
+
+    def mark(self, bind, healthy, error=None):
+        """ Records the health of a replica, logging when it changes """
+        with self._lock:
+            _, was_healthy = self._health.get(bind, (None, None))
+            self._health[bind] = (time.monotonic(), healthy)
+        if not healthy and was_healthy is not False:
+            self.logger.warning('Replica %s is down, reading from the primary: %s', bind, error)
+        elif healthy and was_healthy is False:
+            self.logger.info('Replica %s is back in rotation', bind)
+
+    def _query_failed(self, bind):
+        def handle_error(context):
+            if context.is_disconnect or isinstance(context.sqlalchemy_exception, OperationalError):
+                self.mark(bind, False, context.original_exception)
+        return handle_error
+
+    def status(self):
+        """ Returns whether each replica is in rotation """
+        with self._lock:
+            return dict((bind, self._health.get(bind, (None, None))[1]) for bind in self.binds)
+
+
+class RoutingSession(flask_sqlalchemy.SignallingSession):
+    """ Session that sends the queries of read-only requests to a replica """
+
+    def __init__(self, db, **options):
+        self.db = db
+        super(RoutingSession, self).__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kw):
+        if bind is not None:
+            return bind
+        if has_request_context() and not self._flushing and not getattr(clause, 'is_dml', False):
+            engine = g.get('db_replica')
+            if engine is None and g.get('db_read_only'):
+                router = self.app.extensions.get('replicas')
+                engine = g.db_replica = router.choose(self.db, self.app) if router else None
+                g.db_read_only = engine is not None
+            if engine is not None:
+                return engine
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+def replica_binds(uris):
+    """ Returns the SQLALCHEMY_BINDS entries of the replica URIs """
+    return dict(('replica_{}'.format(number), uri) for number, uri in enumerate(uris))
+
+def is_read_only_request(endpoint):
+    """ Returns True if the current request may read from a replica """
+    if request.method != 'GET' or endpoint not in READ_ENDPOINTS:
+        return False
+    try:
+        primary_until = float(request.cookies.get(PRIMARY_COOKIE, 0))
+    except ValueError:
+        primary_until = 0
+    return primary_until < time.time()
+
+def route_request(endpoint):
+    """ Decides whether the queries of the current request may go to a replica """
+    g.db_read_only = bool(current_app.extensions.get('replicas')) and is_read_only_request(endpoint)
+
+def stick_to_primary(response):
+    """ Keeps a client that just wrote on the primary for READ_YOUR_WRITES_SECONDS """
+    seconds = current_app.config['READ_YOUR_WRITES_SECONDS']
+    if (current_app.extensions.get('replicas') and seconds
+            and request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400):
+        response.set_cookie(PRIMARY_COOKIE, '{:.3f}'.format(time.time() + seconds),
+                            max_age=seconds, httponly=True)
+    return response
@@ -19,74 +19,188 @@ This modules provides a REST API for the Pet Model
 
 Paths:
 ------
-GET /pets - Lists all of the Pets
+GET /pets - Lists all of the Pets, filtered by category, name and available
+GET /pets?include=category - Lists the Pets with the name of their Category
+GET /pets/sorted - Lists all of the Pets sorted by name
+GET /pets/search?q={text} - Searches the Pets by name prefix and similarity
+GET /pets/stats - Returns the number of Pets that are available and sold
 GET /pets/{id} - Retrieves a single Pet with the specified id
 POST /pets - Creates a new Pet
+POST /pets/bulk - Creates many Pets from a JSON array or NDJSON body
 PUT /pets/{id} - Updates a single Pet with the specified id
+PATCH /pets - Updates the fields in the body on every Pet matching the filters
+PATCH /pets/{id} - Updates the fields in the body on a single Pet
+DELETE /pets - Deletes every Pet matching the filters
 DELETE /pets/{id} - Deletes a single Pet with the specified id
 POST /pets/{id}/purchase - Action to purchase a Pet
+GET /categories?embed=members - Lists the Categories with their member Pets
+GET /categories/{id}?embed=members - Retrieves a Category with its member Pets
+PATCH /categories/{id} - Updates the fields in the body on a single Category
+GET /categories/stats - Returns the number of Pets that are available and sold per Category
+GET /pool/stats - Returns the database connection pool statistics of this worker
+GET /metrics - Returns the request count, latency and database time per endpoint
+
+List endpoints accept a limit parameter (DEFAULT_PAGE_SIZE rows when
+it is missing, at most MAX_PAGE_SIZE) and return the cursor for the
+next page in the X-Next-Cursor and Link headers. Pass it back as the
+cursor parameter to fetch the next page.
+
+List endpoints stream their results from a server-side cursor when the
+client accepts application/x-ndjson, or when stream=true is passed, in
+which case a JSON array is streamed. Streamed responses carry no cursor.
+
+GET responses carry an ETag. Send it back in If-None-Match to get a
+304 Not Modified when nothing has changed, or in If-Match on a PUT, PATCH
+or DELETE to get a 412 Precondition Failed if someone else changed it first.
+
+When read replicas are configured, the GET requests of the list and
+retrieve endpoints read from them, except for a client that wrote in
+the last few seconds, which reads from the primary until then.
+
+Every response carries the number of SQL queries it ran in X-DB-Query-Count
+and its database and application time in Server-Timing.
 """
 
 import sys
+import time
+import atexit
+import hashlib
 import logging
+import click
 from flask import jsonify, request, url_for, make_response, abort, render_template
+from flask import Blueprint, current_app
+from flask.cli import with_appcontext
+from flask import json, Response, stream_with_context
 from flask_api import status    # HTTP Status Codes
-from app.models import Pet, Category, DataValidationError
+from sqlalchemy.orm.exc import StaleDataError
+from app.models import (Pet, Category, CategoryCache, ChangeCounter, PetCounter,
+                        DataValidationError, is_integer)
 from app.forms import PetForm, CategoryForm
-from app import app
+from app.pagination import paginate, keyset_query
+from app.cache import create_cache
+from app.encoding import encode_json
+from app.logs import start_queue_logging, SamplingFilter, log_access
+from app import db, pool_metrics, metrics, replicas, get_app
+
+# The routes, error handlers and request hooks of the Pet API
+api = Blueprint('api', __name__)
 
 ######################################################################
 # Error Handlers
 ######################################################################
-@app.errorhandler(DataValidationError)
+@api.app_errorhandler(DataValidationError)
 def request_validation_error(error):
     """ Handles Value Errors from bad data """
     return bad_request(error)
 
-@app.errorhandler(400)
+@api.app_errorhandler(400)
 def bad_request(error):
     """ Handles bad reuests with 400_BAD_REQUEST """
     message = str(error)
-    app.logger.info(message)
+    current_app.logger.info(message)
     return jsonify(status=400, error='Bad Request', message=message), 400
 
-@app.errorhandler(404)
+@api.app_errorhandler(404)
 def not_found(error):
     """ Handles resources not found with 404_NOT_FOUND """
     message = str(error)
-    app.logger.info(message)
+    current_app.logger.info(message)
     return jsonify(status=404, error='Not Found', message=message), 404
 
-@app.errorhandler(405)
+@api.app_errorhandler(405)
 def method_not_supported(error):
     """ Handles unsuppoted HTTP methods with 405_METHOD_NOT_SUPPORTED """
     message = str(error)
-    app.logger.info(message)
+    current_app.logger.info(message)
     return jsonify(status=405, error='Method not Allowed', message=message), 405
 
-@app.errorhandler(415)
+@api.app_errorhandler(415)
 def mediatype_not_supported(error):
     """ Handles unsuppoted media requests with 415_UNSUPPORTED_MEDIA_TYPE """
     message = str(error)
-    app.logger.info(message)
+    current_app.logger.info(message)
     return jsonify(status=415, error='Unsupported media type', message=message), 415
 
-@app.errorhandler(500)
+@api.app_errorhandler(StaleDataError)
+def stale_data_error(error):
+    """
+    Handles concurrent updates of the same version
+
+    Only a request that sent If-Match had a precondition to fail, any
+    other lost race is a 409 Conflict.
+    """
+    db.session.rollback()
+    if not request.if_match:
+        return conflict('The resource was changed by another request')
+    return precondition_failed('The resource was changed by another request')
+
+@api.app_errorhandler(409)
+def conflict(error):
+    """ Handles requests that conflict with the state of the resource with 409_CONFLICT """
+    message = str(error)
+    current_app.logger.info(message)
+    return jsonify(status=409, error='Conflict', message=message), 409
+
+@api.app_errorhandler(412)
+def precondition_failed(error):
+    """ Handles failed If-Match checks with 412_PRECONDITION_FAILED """
+    message = str(error)
+    current_app.logger.info(message)
+    return jsonify(status=412, error='Precondition Failed', message=message), 412
+
+@api.app_errorhandler(500)
 def internal_server_error(error):
     """ Handles unexpected server error with 500_SERVER_ERROR """
     message = str(error)
-    app.logger.info(message)
+    current_app.logger.info(message)
     return jsonify(status=500, error='Internal Server Error', message=message), 500
 
+######################################################################
+# Request Metrics
+######################################################################
+@api.before_app_request
+def start_request_metrics():
+    """ Starts timing the request """
+    metrics.start_request(get_endpoint_name(), current_app.config['SLOW_QUERY_THRESHOLD'])
+
+@api.after_app_request
+def finish_request_metrics(response):
+    """ Records the count, status and latency of the request """
+    timer = metrics.finish_request(request.method, get_endpoint_name(), response.status_code)
+    if timer:
+        response.headers['X-DB-Query-Count'] = str(timer.queries)
+        response.headers['Server-Timing'] = timer.server_timing()
+    if current_app.config['ACCESS_LOG']:
+        log_access(response, timer, get_endpoint_name())
+    startup = current_app.extensions['startup']
+    if startup['first_request_seconds'] is None:
+        startup['first_request_seconds'] = time.perf_counter() - startup['created']
+        current_app.logger.info('First request served %.1f ms after the app was created',
+                                startup['first_request_seconds'] * 1000)
+    return response
+
+######################################################################
+# Read Replica Routing
+######################################################################
+@api.before_app_request
+def route_database():
+    """ Lets the queries of read-only requests go to a replica """
+    replicas.route_request(get_endpoint_name())
+
+@api.after_app_request
+def remember_writes(response):
+    """ Keeps a client that just wrote reading from the primary """
+    return replicas.stick_to_primary(response)
+
 ######################################################################
 # GET INDEX
 ######################################################################
-@app.route('/')
+@api.route('/')
 def index():
     """ Send back the home page """
-    app.logger.info('Home page request')
-    category_select = [(category.id, category.name) for category in Category.all()]
-    app.logger.info('Categories: %s', category_select)
+    current_app.logger.info('Home page request')
+    category_select = Category.choices()
+    current_app.logger.info('Categories: %d', len(category_select))
     form = PetForm()
     form.category_id.choices = category_select
     category = CategoryForm()
@@ -96,56 +210,77 @@ def index():
 ######################################################################
 # LIST ALL PETS
 ######################################################################
-@app.route('/pets', methods=['GET'])
+@api.route('/pets', methods=['GET'])
 def list_pets():
     """ Returns all of the Pets """
-    app.logger.info('Listing Pets...')
-    pets = []
-    category = request.args.get('category')
-    name = request.args.get('name')
-    available = request.args.get('available')
-    if category:
-        pets = Pet.find_by_category(category)
-    elif name:
-        pets = Pet.find_by_name(name)
-    elif available:
-        pets = Pet.find_by_availability(available.lower() in ['true', '1', 't'])
-    else:
-        pets = Pet.all()
+    current_app.logger.info('Listing Pets...')
+    query = Pet.find_by_filters(**get_pet_filters())
+    include_category = 'category' in get_list_arg('include')
+    return make_list_response(Pet.as_rows(query, category=include_category), [Pet.id],
+                              serialize_row)
 
-    results = [pet.serialize() for pet in pets]
-    return make_response(jsonify(results), status.HTTP_200_OK)
-
-@app.route('/pets/sorted', methods=['GET'])
+@api.route('/pets/sorted', methods=['GET'])
 def list_sorted():
     """ Returns all of the Pets """
-    app.logger.info('Get sorted Pets...')
-    pets = []
-    pets = Pet.all_sorted()
+    current_app.logger.info('Get sorted Pets...')
+    # the id breaks ties between pets with the same name
+    return make_list_response(Pet.as_rows(Pet.query), [Pet.name, Pet.id], serialize_row,
+                              descending=True)
 
-    results = [pet.serialize() for pet in pets]
-    return make_response(jsonify(results), status.HTTP_200_OK)
+######################################################################
+# SEARCH PETS BY NAME
+######################################################################
+@api.route('/pets/search', methods=['GET'])
+def search_pets():
+    """
+    Returns the Pets whose name starts with or resembles q
+
+    The best matches come first and the results are paginated like the
+    other lists.
+    """
+    text = request.args.get('q', '').strip()
+    current_app.logger.info('Searching Pets for %s...', text)
+    if not text:
+        raise DataValidationError('The q parameter is required')
+    query, rank = Pet.search(text)
+    return make_list_response(query, [rank, Pet.id], serialize_search_row)
+
+######################################################################
+# PET STATISTICS
+######################################################################
+@api.route('/pets/stats', methods=['GET'])
+def pet_stats():
+    """ Returns the number of Pets, available Pets and sold Pets """
+    current_app.logger.info('Counting Pets...')
+    return make_stats_response(Pet.stats)
 
 ######################################################################
 # RETRIEVE A PET
 ######################################################################
-@app.route('/pets/<int:pet_id>', methods=['GET'])
+@api.route('/pets/<int:pet_id>', methods=['GET'])
 def get_pets(pet_id):
     """
     Retrieve a single Pet
 
     This endpoint will return a Pet based on it's id
     """
-    app.logger.info('Retrieve a Pet with ID:(%s)...', pet_id)
+    current_app.logger.info('Retrieve a Pet with ID:(%s)...', pet_id)
+    if request.if_none_match:
+        # only the version is needed to tell if the client is up to date
+        version = Pet.find_version(pet_id)
+        if version is not None:
+            check_not_modified(str(version))
     pet = Pet.find(pet_id)
     if not pet:
         abort(status.HTTP_404_NOT_FOUND, "Pet with id '{}' was not found.".format(pet_id))
-    return make_response(jsonify(pet.serialize()), status.HTTP_200_OK)
+    response = make_response(jsonify(pet.serialize()), status.HTTP_200_OK)
+    response.set_etag(str(pet.version))
+    return response
 
 ######################################################################
 # ADD A NEW PET
 ######################################################################
-@app.route('/pets', methods=['POST'])
+@api.route('/pets', methods=['POST'])
 def create_pets():
     """
     Creates a Pet
@@ -153,71 +288,193 @@ def create_pets():
     This endpoint will create a Pet based the data in the body that is posted
     or data that is sent via an html form post.
     """
-    app.logger.info('Creating Pet...')
+    current_app.logger.info('Creating Pet...')
     data = {}
-    # Check for form submission data
-    form = PetForm()
-    form.category_id.choices = [(category.id, category.name) for category in Category.all()]
-    if form.validate_on_submit():
-        app.logger.info('Processing FORM data')
+    # Check for form submission data, JSON bodies never need the form choices
+    form = None
+    if request.mimetype != 'application/json':
+        form = PetForm()
+        form.category_id.choices = Category.choices()
+    if form and form.validate_on_submit():
+        current_app.logger.info('Processing FORM data')
         data = {
             'name': form.name.data,
             'category_id': form.category_id.data,
             'available': form.available.data
         }
     # if request.headers.get('Content-Type') == 'application/x-www-form-urlencoded':
-    #     app.logger.info('Processing FORM data')
-    #     app.logger.info('Form: %s', request.form)
+    #     current_app.logger.info('Processing FORM data')
+    #     current_app.logger.info('Form: %s', request.form)
     #     data = {
     #         'name': request.form['name'],
     #         'category_id': request.form['category'],
     #         'available': request.form['available'].lower() in ['true', '1', 't']
     #     }
     else:
-        app.logger.info('Processing JSON data')
+        current_app.logger.info('Processing JSON data')
         data = request.get_json()
-    app.logger.debug('Data: %s', data)
+    current_app.logger.debug('Data: %s', data)
     pet = Pet()
     pet.deserialize(data)
+    check_category(pet.category_id)
     pet.save()
     message = pet.serialize()
     return make_response(jsonify(message), status.HTTP_201_CREATED,
-                         {'Location': url_for('get_pets', pet_id=pet.id, _external=True)})
+                         {'Location': url_for('.get_pets', pet_id=pet.id, _external=True)})
+
+######################################################################
+# ADD MANY NEW PETS
+######################################################################
+@api.route('/pets/bulk', methods=['POST'])
+def create_pets_bulk():
+    """
+    Creates many Pets
+
+    This endpoint will create a Pet for every valid record in a JSON array
+    or an NDJSON body. Invalid records are reported by their index and do
+    not stop the valid ones from being created.
+    """
+    current_app.logger.info('Creating Pets in bulk...')
+    records = get_bulk_records()
+    # check every category with one query instead of one per record
+    category_ids = Category.find_ids(set(
+        record.get('category_id') for record in records
+        if isinstance(record, dict) and is_integer(record.get('category_id'))))
+    pets = []
+    errors = []
+    for index, record in enumerate(records):
+        try:
+            pet = Pet().deserialize(record)
+            Pet.deserialize_fields(record)      # check the types of the fields
+            if pet.category_id not in category_ids:
+                raise DataValidationError('Invalid pet: category {} was not found'.format(pet.category_id))
+        except DataValidationError as error:
+            errors.append({'index': index, 'message': str(error)})
+            continue
+        pets.append(pet)
+
+    ids = []
+    if pets:
+        ids = Pet.bulk_insert(pets, current_app.config['BULK_BATCH_SIZE'])
+    current_app.logger.info('Created %d Pets with %d errors', len(ids), len(errors))
+    return_code = status.HTTP_201_CREATED if ids or not errors else status.HTTP_400_BAD_REQUEST
+    return make_response(jsonify(ids=ids, errors=errors), return_code)
 
 ######################################################################
 # UPDATE AN EXISTING PET
 ######################################################################
-@app.route('/pets/<int:pet_id>', methods=['PUT'])
+@api.route('/pets/<int:pet_id>', methods=['PUT'])
 def update_pets(pet_id):
     """
     Update a Pet
 
     This endpoint will update a Pet based the body that is posted
     """
-    app.logger.info('Updating a Pet with ID:(%s)...', pet_id)
+    current_app.logger.info('Updating a Pet with ID:(%s)...', pet_id)
     pet = Pet.find_or_404(pet_id)
+    check_precondition(pet.version)
     pet.deserialize(request.get_json())
+    check_category(pet.category_id)
     pet.id = pet_id
     pet.save()
-    return make_response(jsonify(pet.serialize()), status.HTTP_200_OK)
+    response = make_response(jsonify(pet.serialize()), status.HTTP_200_OK)
+    response.set_etag(str(pet.version))
+    return response
+
+######################################################################
+# UPDATE SOME FIELDS OF A PET
+######################################################################
+@api.route('/pets/<int:pet_id>', methods=['PATCH'])
+def patch_pets(pet_id):
+    """
+    Update some fields of a Pet
+
+    This endpoint will set only the fields in the body, using a single
+    UPDATE statement without loading the Pet first
+    """
+    current_app.logger.info('Patching a Pet with ID:(%s)...', pet_id)
+    values = Pet.deserialize_fields(request.get_json())
+    if 'category_id' in values:
+        check_category(values['category_id'])
+    versions = get_if_match_versions()
+    row = Pet.update_fields(pet_id, values, versions)
+    if row is None:
+        check_update_failed(Pet, pet_id, versions, "Pet with id '{}' was not found.")
+    return make_row_response(row)
+
+######################################################################
+# PURCHASE A PET
+######################################################################
+@api.route('/pets/<int:pet_id>/purchase', methods=['POST'])
+def purchase_pets(pet_id):
+    """
+    Purchase a Pet
+
+    This endpoint will mark an available Pet as sold. Of many concurrent
+    buyers only one gets the Pet, the others get 409 Conflict.
+    """
+    current_app.logger.info('Purchasing a Pet with ID:(%s)...', pet_id)
+    row = Pet.purchase(pet_id)
+    if row is None:
+        if Pet.find_version(pet_id) is None:
+            abort(status.HTTP_404_NOT_FOUND, "Pet with id '{}' was not found.".format(pet_id))
+        abort(status.HTTP_409_CONFLICT, "Pet with id '{}' is not available.".format(pet_id))
+    return make_row_response(row)
+
+######################################################################
+# UPDATE MANY PETS
+######################################################################
+@api.route('/pets', methods=['PATCH'])
+def update_pets_bulk():
+    """
+    Update many Pets
+
+    This endpoint will set the fields in the body on every Pet that matches
+    the query parameters, using a single UPDATE statement
+    """
+    current_app.logger.info('Updating Pets in bulk...')
+    filters = get_pet_filters(required=True)
+    values = Pet.deserialize_fields(request.get_json())
+    if 'category_id' in values:
+        check_category(values['category_id'])
+    count = Pet.update_by_filters(values, **filters)
+    return make_response(jsonify(count=count), status.HTTP_200_OK)
 
 ######################################################################
 # DELETE A PET
 ######################################################################
-@app.route('/pets/<int:pet_id>', methods=['DELETE'])
+@api.route('/pets/<int:pet_id>', methods=['DELETE'])
 def delete_pets(pet_id):
     """
     Delete a Pet
 
-    This endpoint will delete a Pet based the id specified in the path
+    This endpoint will delete a Pet based the id specified in the path,
+    using a single DELETE statement
     """
-    app.logger.info('Deleting a Pet with ID:(%s)...', pet_id)
-    pet = Pet.find(pet_id)
-    if pet:
-        pet.delete()
+    current_app.logger.info('Deleting a Pet with ID:(%s)...', pet_id)
+    versions = get_if_match_versions()
+    if not Pet.delete_by_id(pet_id, versions):
+        check_delete_failed(versions)
     return make_response('', status.HTTP_204_NO_CONTENT)
 
 
+######################################################################
+# DELETE MANY PETS
+######################################################################
+@api.route('/pets', methods=['DELETE'])
+def delete_pets_bulk():
+    """
+    Delete many Pets
+
+    This endpoint will delete every Pet that matches the query parameters,
+    using a single DELETE statement
+    """
+    current_app.logger.info('Deleting Pets in bulk...')
+    filters = get_pet_filters(required=True)
+    count = Pet.delete_by_filters(**filters)
+    return make_response(jsonify(count=count), status.HTTP_200_OK)
+
+
 ######################################################################
 ######################################################################
 #  C A T E G O R Y   R O U T E S
@@ -228,34 +485,59 @@ def delete_pets(pet_id):
 ######################################################################
 # LIST ALL CATEGORIES
 ######################################################################
-@app.route('/categories', methods=['GET'])
+@api.route('/categories', methods=['GET'])
 def list_categories():
     """ Returns all of the Categories """
-    app.logger.info('Listing Categories...')
-    categories = Category.all()
-    results = [category.serialize() for category in categories]
-    return make_response(jsonify(results), status.HTTP_200_OK)
+    current_app.logger.info('Listing Categories...')
+    if 'members' in get_list_arg('embed'):
+        query = Category.with_members(Category.query)
+        return make_list_response(query, [Category.id],
+                                  lambda category: category.serialize(members=True))
+    return make_list_response(Category.as_rows(Category.query), [Category.id], serialize_row)
+
+######################################################################
+# CATEGORY STATISTICS
+######################################################################
+@api.route('/categories/stats', methods=['GET'])
+def category_stats():
+    """ Returns the number of Pets, available Pets and sold Pets in each Category """
+    current_app.logger.info('Counting Pets by Category...')
+    return make_stats_response(Category.stats)
 
 ######################################################################
 # RETRIEVE A CATEGORY
 ######################################################################
-@app.route('/categories/<int:category_id>', methods=['GET'])
+@api.route('/categories/<int:category_id>', methods=['GET'])
 def get_categories(category_id):
     """
     Retrieve a single Category
 
     This endpoint will return a Category based on it's id
     """
-    app.logger.info('Retrieve a Category with ID:(%s)...', category_id)
-    category = Category.find(category_id)
+    current_app.logger.info('Retrieve a Category with ID:(%s)...', category_id)
+    members = 'members' in get_list_arg('embed')
+    # the members change with the pet table, not with the category row
+    generation = ''
+    if members:
+        generation = '-{}'.format(ChangeCounter.generations().get(Pet.__tablename__, 0))
+    if request.if_none_match:
+        version = Category.find_version(category_id)
+        if version is not None:
+            check_not_modified('{}{}'.format(version, generation))
+    if members:
+        category = Category.find_with_members(category_id)
+    else:
+        category = Category.find(category_id)
     if not category:
         abort(status.HTTP_404_NOT_FOUND, "Category with id '{}' was not found.".format(category_id))
-    return make_response(jsonify(category.serialize()), status.HTTP_200_OK)
+    response = make_response(jsonify(category.serialize(members=members)), status.HTTP_200_OK)
+    response.set_etag('{}{}'.format(category.version, generation))
+    return response
 
 ######################################################################
 # ADD A NEW CATEGORY
 ######################################################################
-@app.route('/categories', methods=['POST'])
+@api.route('/categories', methods=['POST'])
 def create_categories():
     """
     Creates a Category
@@ -263,62 +545,132 @@ def create_categories():
     This endpoint will create a Category based the data in the body that is posted
     or data that is sent via an html form post.
     """
-    app.logger.info('Creating Category...')
+    current_app.logger.info('Creating Category...')
     data = {}
     # Check for form submission data
     if request.headers.get('Content-Type') == 'application/x-www-form-urlencoded':
-        app.logger.info('Processing FORM data')
+        current_app.logger.info('Processing FORM data')
         data = {
             'name': request.form['name'],
         }
     else:
-        app.logger.info('Processing JSON data')
+        current_app.logger.info('Processing JSON data')
         data = request.get_json()
     category = Category()
     category.deserialize(data)
     category.save()
     message = category.serialize()
     return make_response(jsonify(message), status.HTTP_201_CREATED,
-                         {'Location': url_for('get_categories', category_id=category.id, _external=True)})
+                         {'Location': url_for('.get_categories', category_id=category.id, _external=True)})
 
 ######################################################################
 # UPDATE AN EXISTING CATEGORY
 ######################################################################
-@app.route('/categories/<int:category_id>', methods=['PUT'])
+@api.route('/categories/<int:category_id>', methods=['PUT'])
 def update_categories(category_id):
     """
     Update a Category
 
     This endpoint will update a Category based the body that is posted
     """
-    app.logger.info('Updating a Category with ID:(%s)...', category_id)
+    current_app.logger.info('Updating a Category with ID:(%s)...', category_id)
     category = Category.find_or_404(category_id)
+    check_precondition(category.version)
     category.deserialize(request.get_json())
     category.id = category_id
     category.save()
-    return make_response(jsonify(category.serialize()), status.HTTP_200_OK)
+    response = make_response(jsonify(category.serialize()), status.HTTP_200_OK)
+    response.set_etag(str(category.version))
+    return response
+
+######################################################################
+# UPDATE SOME FIELDS OF A CATEGORY
+######################################################################
+@api.route('/categories/<int:category_id>', methods=['PATCH'])
+def patch_categories(category_id):
+    """
+    Update some fields of a Category
+
+    This endpoint will set only the fields in the body, using a single
+    UPDATE statement without loading the Category first
+    """
+    current_app.logger.info('Patching a Category with ID:(%s)...', category_id)
+    values = Category.deserialize_fields(request.get_json())
+    versions = get_if_match_versions()
+    row = Category.update_fields(category_id, values, versions)
+    if row is None:
+        check_update_failed(Category, category_id, versions,
+                            "Category with id '{}' was not found.")
+    return make_row_response(row)
 
 ######################################################################
 # DELETE A CATEGORY
 ######################################################################
-@app.route('/categories/<int:category_id>', methods=['DELETE'])
+@api.route('/categories/<int:category_id>', methods=['DELETE'])
 def delete_categories(category_id):
     """
     Delete a Category
 
-    This endpoint will delete a Category based the id specified in the path
+    This endpoint will delete a Category and all of its Pets based the id
+    specified in the path, using a single DELETE statement that the
+    database cascades to the Pets
     """
-    app.logger.info('Delete a Category with ID:(%s)...', category_id)
-    category = Category.find(category_id)
-    if category:
-        category.delete()
+    current_app.logger.info('Delete a Category with ID:(%s)...', category_id)
+    versions = get_if_match_versions()
+    if not Category.delete_by_id(category_id, versions):
+        check_delete_failed(versions)
     return make_response('', status.HTTP_204_NO_CONTENT)
 
+######################################################################
+# CONNECTION POOL STATISTICS
+######################################################################
+@api.route('/pool/stats', methods=['GET'])
+def get_pool_stats():
+    """ Returns the connection pool statistics of this worker """
+    stats = pool_metrics.stats(db.engine.pool)
+    router = current_app.extensions['replicas']
+    if router:
+        stats['replicas'] = router.status()
+    return make_response(jsonify(stats), status.HTTP_200_OK)
+
+######################################################################
+# PROMETHEUS METRICS
+######################################################################
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    """ Returns the request metrics in the Prometheus text format """
+    body, content_type = metrics.generate_metrics()
+    return Response(body, status=status.HTTP_200_OK, content_type=content_type)
+
 
 ######################################################################
 #  U T I L I T Y   F U N C T I O N S
 ######################################################################
 
+def init_app(app):
+    """ Registers the Pet API and its caches on an app """
+    app.register_blueprint(api)
+    app.cli.add_command(rebuild_stats_command)
+    # Cache of encoded list pages shared by the list endpoints
+    app.extensions['result_cache'] = create_cache(app.config)
+    # Cache of the Categories of this app's database
+    app.extensions['category_cache'] = CategoryCache()
+
+@click.command('rebuild-stats')
+@with_appcontext
+def rebuild_stats_command():
+    """ Counts every Pet again into the statistics counters """
+    PetCounter.rebuild()
+    click.echo('Rebuilt the Pet counters')
+
+def get_result_cache():
+    """ Returns the result cache of the current app """
+    return current_app.extensions['result_cache']
+
+def get_endpoint_name():
+    """ Returns the name of the view handling the request without the blueprint """
+    return request.endpoint.rpartition('.')[2] if request.endpoint else None
+
 def init_db():
     """ Initialies the SQLAlchemy app """
     Pet.init_db()
@@ -328,23 +680,307 @@ def truncate_db():
     Pet.delete_all()
     Category.delete_all()
 
-#@app.before_first_request
-def initialize_logging(log_level=logging.INFO):
+def get_pet_filters(required=False, args=None):
+    """
+    Returns the Pet filters in the query parameters of a request
+
+    Supported filters are id (repeatable), category, name and available.
+    Empty parameters are treated the same as missing ones. When required
+    is True at least one filter must be given so that a missing parameter
+    can never update or delete every Pet, and available must be an
+    explicit true or false so that a typo can't select the sold Pets.
+    """
+    if args is None:
+        args = request.args
+    filters = {}
+    ids = args.getlist('id')
+    if ids:
+        try:
+            filters['ids'] = [int(pet_id) for pet_id in ids]
+        except ValueError:
+            raise DataValidationError('Invalid id: {}'.format(ids))
+        if not all(is_integer(pet_id) for pet_id in filters['ids']):
+            raise DataValidationError('Invalid id: {}'.format(ids))
+    if args.get('category'):
+        try:
+            filters['category'] = int(args.get('category'))
+        except ValueError:
+            raise DataValidationError('Invalid category: {}'.format(args.get('category')))
+        if not is_integer(filters['category']):
+            raise DataValidationError('Invalid category: {}'.format(args.get('category')))
+    if args.get('name'):
+        filters['name'] = args.get('name')
+    if args.get('available'):
+        available = args.get('available').lower()
+        if required and available not in ['true', '1', 't', 'false', '0', 'f']:
+            raise DataValidationError('Invalid available: {}'.format(args.get('available')))
+        filters['available'] = available in ['true', '1', 't']
+    if required and not filters:
+        raise DataValidationError('At least one of id, category, name or available is required')
+    return filters
+
+def get_bulk_records():
+    """ Returns the records in a JSON array or an NDJSON request body """
+    if request.mimetype == 'application/x-ndjson':
+        records = []
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                records.append(None)     # reported as bad data for this record
+        return records
+    records = request.get_json()
+    if not isinstance(records, list):
+        raise DataValidationError('Invalid request: body must be a JSON array or NDJSON')
+    return records
+
+def get_list_arg(name):
+    """ Returns the comma separated values of a query parameter as a list """
+    return [value.strip() for value in request.args.get(name, '').split(',') if value.strip()]
+
+def get_page_args(args=None, paged=True):
+    """
+    Returns the limit and cursor query parameters of a list request
+
+    A paged list without a limit gets DEFAULT_PAGE_SIZE rows. A streamed
+    list (paged=False) has no next cursor, so it only stops at a limit the
+    client asked for.
+    """
+    if args is None:
+        args = request.args
+    limit = args.get('limit', current_app.config['DEFAULT_PAGE_SIZE'] if paged else None)
+    cursor = args.get('cursor')
+    if limit is None:
+        return None, cursor
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise DataValidationError('Invalid limit: {}'.format(limit))
+    if limit < 1:
+        raise DataValidationError('Invalid limit: {}'.format(limit))
+    return min(limit, current_app.config['MAX_PAGE_SIZE']), cursor
+
+def make_page_response(body, next_cursor):
+    """ Makes a list response from an encoded page and links to the next page """
+    headers = {}
+    if next_cursor:
+        args = request.args.to_dict()
+        args['cursor'] = next_cursor
+        next_url = url_for(request.endpoint, _external=True, **args)
+        headers['X-Next-Cursor'] = next_cursor
+        headers['Link'] = '<{}>; rel="next"'.format(next_url)
+    response = make_response(body, status.HTTP_200_OK, headers)
+    response.mimetype = 'application/json'
+    return response
+
+def get_stream_type():
+    """ Returns the media type to stream a list as or None to send a page """
+    mimetype = request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson'])
+    if mimetype == 'application/x-ndjson':
+        return mimetype
+    if request.args.get('stream', '').lower() in ['true', '1', 't']:
+        return 'application/json'
+    return None
+
+def make_stream_response(query, mimetype, serialize):
+    """
+    Streams the results of a query as a JSON array or as NDJSON
+
+    Rows are read from a server-side cursor in batches and each batch is
+    encoded and sent before the next one is fetched, so only one batch is
+    held in memory no matter how many rows the query returns.
+    """
+    batch_size = current_app.config['STREAM_BATCH_SIZE']
+    query = query.execution_options(stream_results=True).yield_per(batch_size)
+    ndjson = mimetype == 'application/x-ndjson'
+
+    def generate():
+        if not ndjson:
+            yield '['
+        separator = '\n' if ndjson else ','
+        first = True
+        chunk = []
+        for row in query:
+            chunk.append(json.dumps(serialize(row), separators=(',', ':')))
+            if len(chunk) == batch_size:
+                yield ('' if first else separator) + separator.join(chunk)
+                first = False
+                chunk = []
+        if chunk:
+            yield ('' if first else separator) + separator.join(chunk)
+            first = False
+        if ndjson:
+            yield '' if first else '\n'
+        else:
+            yield ']\n'
+
+    return Response(stream_with_context(generate()), status=status.HTTP_200_OK, mimetype=mimetype)
+
+def make_list_response(query, columns, serialize=None, descending=False):
+    """
+    Makes a paginated or streamed response for a list query
+
+    The response carries an etag of the table generations and the request
+    arguments. A client that sends it back in If-None-Match gets 304 Not
+    Modified without the list query being run. Pages are kept in the result
+    cache under the same etag, so any write to the tables retires them.
+    """
+    if serialize is None:
+        serialize = lambda row: row.serialize()
+    stream_type = get_stream_type()
+    limit, cursor = get_page_args(paged=not stream_type)
+    etag = get_list_etag(stream_type)
+    check_not_modified(etag)
+    if stream_type:
+        query = keyset_query(query, columns, cursor, descending)
+        if limit:
+            query = query.limit(limit)
+        response = make_stream_response(query, stream_type, serialize)
+    else:
+        result_cache = get_result_cache()
+        cached = result_cache.get(etag)
+        if cached is None:
+            rows, next_cursor = paginate(query, columns, limit, cursor, descending)
+            body = encode_json([serialize(row) for row in rows], current_app)
+            # the cursor can't contain a newline, so it prefixes the body
+            result_cache.set(etag, (next_cursor or '').encode('ascii') + b'\n' + body)
+        else:
+            next_cursor, body = cached.split(b'\n', 1)
+            next_cursor = next_cursor.decode('ascii') or None
+        response = make_page_response(body, next_cursor)
+    response.set_etag(etag)
+    return response
+
+def make_stats_response(stats):
+    """
+    Makes a response from a statistics function
+
+    The etag is made from the table generations, so a client that polls
+    gets 304 Not Modified until a Pet or Category is written.
+    """
+    etag = get_list_etag(None)
+    check_not_modified(etag)
+    response = make_response(jsonify(stats()), status.HTTP_200_OK)
+    response.set_etag(etag)
+    return response
+
+def serialize_row(row):
+    """ Serializes a plain row selected with as_rows() """
+    return row._asdict()
+
+def serialize_search_row(row):
+    """ Serializes a row of Pet.search() without its rank """
+    data = row._asdict()
+    del data['rank']
+    return data
+
+def get_list_etag(stream_type):
+    """ Returns the etag of a list request from the table generations """
+    return make_list_etag(request.path, request.args, stream_type, ChangeCounter.generations())
+
+def make_list_etag(path, args, stream_type, generations):
+    """ Makes the etag of a list from its arguments and the table generations """
+    key = json.dumps([path,
+                      sorted(args.items(multi=True)),
+                      stream_type,
+                      sorted(generations.items())])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def check_precondition(version):
+    """
+    Aborts with 412 Precondition Failed if If-Match doesn't match the version
+
+    Requests without If-Match always pass. The version that was checked is
+    also the one the ORM puts in the WHERE clause of the UPDATE or DELETE,
+    so a write that races in after this check fails with a StaleDataError.
+    """
+    if not request.if_match:
+        return
+    if version is None or not request.if_match.contains(str(version)):
+        abort(status.HTTP_412_PRECONDITION_FAILED,
+              'If-Match does not match the current version {}'.format(version))
+
+def check_category(category_id):
+    """ Raises a DataValidationError unless category_id is the id of a Category """
+    if is_integer(category_id):
+        # don't flush the Pet being changed before its category is checked
+        with db.session.no_autoflush:
+            # only a Category created since the cache was loaded needs a query
+            if category_id in Category.get_cache().get() or Category.find_ids([category_id]):
+                return
+    raise DataValidationError('Invalid pet: category {} was not found'.format(category_id))
+
+def get_if_match_versions():
+    """
+    Returns the versions that If-Match accepts, or None if it accepts any
+
+    The versions go in the WHERE clause of a single-statement update, so
+    the check and the write can't be raced.
+    """
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    return [int(tag) for tag in request.if_match.as_set() if tag.isdigit()]
+
+def check_update_failed(model, key, versions, message):
+    """ Aborts an update that matched no row with 404 Not Found or 412 Precondition Failed """
+    version = model.find_version(key) if versions is not None else None
+    if version is None:
+        abort(status.HTTP_404_NOT_FOUND, message.format(key))
+    abort(status.HTTP_412_PRECONDITION_FAILED,
+          'If-Match does not match the current version {}'.format(version))
+
+def check_delete_failed(versions):
+    """
+    Aborts a delete that matched no row with 412 Precondition Failed
+
+    Deleting a row that doesn't exist succeeds, unless If-Match asked for
+    a version of it.
+    """
+    if versions is not None:
+        abort(status.HTTP_412_PRECONDITION_FAILED, 'If-Match does not match the current version')
+
+def make_row_response(row):
+    """ Makes a response from a row with a version, which becomes its etag """
+    data = row._asdict()
+    version = data.pop('version')
+    response = make_response(jsonify(data), status.HTTP_200_OK)
+    response.set_etag(str(version))
+    return response
+
+def check_not_modified(etag):
+    """ Aborts with 304 Not Modified if the client already has the etag """
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', status.HTTP_304_NOT_MODIFIED)
+        response.set_etag(etag)
+        abort(response)
+
+def initialize_logging(log_level=logging.INFO, app=None):
     """ Initialized the default logging to STDOUT """
+    if app is None:
+        app = get_app()
     if not app.debug:
         print('Setting up logging...')
         # Set up default logging for submodules to use STDOUT
         # datefmt='%m/%d/%Y %I:%M:%S %p'
         fmt = '[%(asctime)s] %(levelname)s in %(module)s: %(message)s'
-        logging.basicConfig(stream=sys.stdout, level=log_level, format=fmt)
         # Make a new log handler that uses STDOUT
         handler = logging.StreamHandler(sys.stdout)
         handler.setFormatter(logging.Formatter(fmt))
         handler.setLevel(log_level)
+        if app.config['LOG_QUEUE']:
+            # a listener thread writes to STDOUT so a request never waits on it
+            handler, listener = start_queue_logging([handler], app.config['LOG_QUEUE_SIZE'])
+            atexit.register(listener.stop)
+        handler.addFilter(SamplingFilter(app.config['LOG_SAMPLE_RATES']))
+        logging.basicConfig(level=log_level, handlers=[handler])
         # Remove the Flask default handlers and use our own
         handler_list = list(app.logger.handlers)
         for log_handler in handler_list:
             app.logger.removeHandler(log_handler)
         app.logger.addHandler(handler)
         app.logger.setLevel(log_level)
+        # the handler above already writes the records of app and its modules
+        app.logger.propagate = False
         app.logger.info('Logging handler established')
@@ -0,0 +1,26 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Pet Service Benchmarks
+
+Seed a database and time every route of the Pet API:
+
+    python -m benchmarks.run --pets 100000 --output before.json
+    python -m benchmarks.run --pets 100000 --output after.json
+    python -m benchmarks.compare before.json after.json
+
+The database comes from DATABASE_URI (or --database-uri) and is dropped
+and recreated, so never point it at a database you want to keep.
+"""
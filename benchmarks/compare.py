@@ -0,0 +1,87 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark Comparison
+
+Compares two reports written by benchmarks.run route by route and exits
+with status 1 if any route got slower than the threshold:
+
+    python -m benchmarks.compare before.json after.json [--threshold 10]
+"""
+import sys
+import json
+import argparse
+
+# (report field, label, True if bigger is better)
+FIELDS = [
+    ('throughput', 'req/s', True),
+    ('p50_ms', 'p50', False),
+    ('p95_ms', 'p95', False),
+    ('p99_ms', 'p99', False),
+]
+
+
+def change(before, after):
+    """ Returns the change from before to after in percent """
+    if not before or after is None:
+        return None
+    return (after - before) * 100.0 / before
+
+def compare(before, after, threshold):
+    """ Prints the changes of every route and returns the regressions """
+    regressions = []
+    for mode in sorted(set(before['results']) & set(after['results'])):
+        print('\n{} ({} -> {})'.format(mode, before['meta'].get('commit'), after['meta'].get('commit')))
+        old_routes = before['results'][mode]
+        new_routes = after['results'][mode]
+        for route in [name for name in new_routes if name in old_routes]:
+            cells = []
+            for field, label, bigger_is_better in FIELDS:
+                delta = change(old_routes[route][field], new_routes[route][field])
+                if delta is None:
+                    cells.append('{} n/a'.format(label))
+                    continue
+                worse = -delta if bigger_is_better else delta
+                flag = ''
+                if worse > threshold:
+                    flag = ' !'
+                    regressions.append((mode, route, label, delta))
+                cells.append('{} {:+.1f}%{}'.format(label, delta, flag))
+            print('  {:<45} {}'.format(route, '  '.join(cells)))
+    return regressions
+
+def main(argv=None):
+    """ Compares two benchmark reports """
+    parser = argparse.ArgumentParser(description='Compare two benchmark reports')
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='percent a route may get worse before it is a regression')
+    args = parser.parse_args(argv)
+    with open(args.before) as before_file, open(args.after) as after_file:
+        before = json.load(before_file)
+        after = json.load(after_file)
+    for key in ('database', 'pets', 'requests'):
+        if before['meta'].get(key) != after['meta'].get(key):
+            print('Warning: the runs differ in {}: {} vs {}'.format(
+                key, before['meta'].get(key), after['meta'].get(key)))
+    regressions = compare(before, after, args.threshold)
+    if regressions:
+        print('\n{} regressions over {}%'.format(len(regressions), args.threshold))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
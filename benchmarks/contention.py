@@ -0,0 +1,88 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Purchase Contention Benchmark
+
+Seeds a handful of available Pets and has many parallel buyers try to
+purchase every one of them through a gunicorn server. It reports the
+throughput and latency of POST /pets/{id}/purchase and checks that each
+Pet was sold exactly once: every other attempt must get 409 Conflict.
+
+Usage:
+    python -m benchmarks.contention [--pets N] [--buyers N] [--workers N] [--output FILE]
+"""
+import os
+import sys
+import json
+import random
+import argparse
+from benchmarks.run import (DEFAULT_DATABASE_URI, Workload, HttpClient, start_gunicorn,
+                            measure, git_commit)
+
+
+def main(argv=None):
+    """ Runs the purchase race and writes the JSON report """
+    parser = argparse.ArgumentParser(description='Race buyers for the same Pets')
+    parser.add_argument('--database-uri', default=os.getenv('DATABASE_URI', DEFAULT_DATABASE_URI))
+    parser.add_argument('--pets', type=int, default=20, help='Pets to race for')
+    parser.add_argument('--buyers', type=int, default=32, help='parallel buyers')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--worker-class', default='gthread', help='gunicorn worker class')
+    parser.add_argument('--output', help='JSON report file (default stdout)')
+    args = parser.parse_args(argv)
+
+    os.environ['DATABASE_URI'] = args.database_uri
+    from app import app, db, models
+    workload = Workload(db, models, 0)
+    workload.seed()
+    pet_ids = workload.create_pets(args.pets)
+    db.engine.dispose()
+
+    # every buyer tries every Pet, in its own order
+    requests = []
+    for _ in range(args.buyers):
+        order = list(pet_ids)
+        random.shuffle(order)
+        requests.extend(('POST', '/pets/{}/purchase'.format(pet_id), None) for pet_id in order)
+
+    port, process = start_gunicorn(args.database_uri, args.workers, args.worker_class,
+                                   env={'ACCESS_LOG': 'false'})
+    try:
+        result = measure(HttpClient(port, process), requests, args.buyers, warmup=0)
+    finally:
+        process.terminate()
+        process.wait()
+
+    sold = result['status'].get('200', 0)
+    conflicts = result['status'].get('409', 0)
+    report = {'meta': {'commit': git_commit(), 'database': db.engine.dialect.name,
+                       'pets': args.pets, 'buyers': args.buyers, 'workers': args.workers,
+                       'worker_class': args.worker_class},
+              'purchase': result,
+              'sold_once': sold == args.pets and sold + conflicts == len(requests)}
+    print('{} purchases: {} sold, {} conflicts, {:.1f} req/s, p99 {:.2f} ms'.format(
+        len(requests), sold, conflicts, result['throughput'], result['p99_ms']), file=sys.stderr)
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(output + '\n')
+    else:
+        print(output)
+    if not report['sold_once']:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
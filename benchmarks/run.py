@@ -0,0 +1,429 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark Runner
+
+Seeds the database with a number of Pets and then sends every route of
+the Pet API a number of requests, first through the Flask test client
+(no network, measures the app itself) and then through a real gunicorn
+server over HTTP. For each route it reports the throughput, the p50,
+p95 and p99 latency and the status codes as JSON, along with the peak
+RSS of the processes that served the requests.
+
+Usage:
+    python -m benchmarks.run [--pets N] [--requests N] [--mode client|gunicorn|both]
+                             [--workers N] [--concurrency N] [--output FILE]
+"""
+import os
+import sys
+import json
+import math
+import time
+import socket
+import random
+import argparse
+import platform
+import resource
+import threading
+import subprocess
+import http.client
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_DATABASE_URI = 'sqlite:////tmp/benchmark.db'
+CATEGORIES = ['Dog', 'Cat', 'Bird', 'Fish', 'Snake', 'Hamster', 'Rabbit', 'Lizard']
+SEED_BATCH_SIZE = 10000
+# Pets in each Category that the cascading delete route removes
+CASCADE_PETS = 1000
+
+
+######################################################################
+#  W O R K L O A D
+######################################################################
+
+class Workload(object):
+    """ The seeded data and the requests that exercise each route """
+
+    def __init__(self, db, models, pets, seed=42):
+        self.db = db
+        self.models = models
+        self.pet_count = pets
+        self.random = random.Random(seed)
+        self.category_ids = []
+        self.pet_ids = (0, 0)
+
+    def seed(self):
+        """ Recreates the tables and fills them with Pets """
+        pet = self.models.Pet
+        self.db.drop_all()
+        self.db.create_all()
+        self.models.ChangeCounter.bump('category')
+        self.models.ChangeCounter.bump('pet')
+        for name in CATEGORIES:
+            self.db.session.add(self.models.Category(name=name))
+        self.db.session.commit()
+        self.category_ids = [category.id for category in self.models.Category.all()]
+        insert = pet.__table__.insert()
+        for start in range(0, self.pet_count, SEED_BATCH_SIZE):
+            rows = [{'name': 'pet-{}'.format(number),
+                     'category_id': self.category_ids[number % len(self.category_ids)],
+                     'available': number % 3 != 0}
+                    for number in range(start, min(start + SEED_BATCH_SIZE, self.pet_count))]
+            self.db.session.execute(insert, rows)
+            self.db.session.commit()
+        first, last = self.db.session.query(self.db.func.min(pet.id), self.db.func.max(pet.id)).one()
+        self.pet_ids = (first or 0, last or 0)
+        self.db.session.remove()
+
+    def create_pets(self, count):
+        """ Adds Pets for the routes that delete them and returns their ids """
+        pets = [self.models.Pet(name='victim-{}'.format(number), category_id=self.category_ids[0],
+                    available=True) for number in range(count)]
+        ids = self.models.Pet.bulk_insert(pets)
+        self.db.session.remove()
+        return ids
+
+    def create_categories(self, count, pets=0):
+        """ Adds Categories with pets Pets each for the routes that delete them """
+        ids = []
+        for number in range(count):
+            category = self.models.Category(name='victim-{}'.format(number))
+            self.db.session.add(category)
+            self.db.session.flush()
+            ids.append(category.id)
+        rows = [{'name': 'victim-{}'.format(number), 'category_id': category_id, 'available': True}
+                for category_id in ids for number in range(pets)]
+        for start in range(0, len(rows), SEED_BATCH_SIZE):
+            self.db.session.execute(self.models.Pet.__table__.insert(),
+                                    rows[start:start + SEED_BATCH_SIZE])
+        self.models.ChangeCounter.bump('category')
+        self.models.ChangeCounter.bump('pet')
+        self.db.session.commit()
+        self.db.session.remove()
+        return ids
+
+    def any_pet(self):
+        """ Returns the id of a random seeded Pet """
+        return self.random.randint(*self.pet_ids)
+
+    def new_pet(self):
+        """ Returns the body of a new Pet """
+        return {'name': 'bench-{}'.format(self.random.randint(0, 10 ** 9)),
+                'category_id': self.random.choice(self.category_ids),
+                'available': True}
+
+    def routes(self, requests):
+        """
+        Returns (name, requests) for every route of the API
+
+        Each request is (method, path, json body). The routes that delete
+        get Pets and Categories of their own so that every request deletes a
+        real row. The cascading delete removes CASCADE_PETS Pets per request,
+        so it is sent a tenth as often.
+        """
+        category = self.category_ids[0]
+        name = 'pet-{}'.format(self.pet_count // 2)
+        victims = iter(self.create_pets(requests * 2))
+        empty_categories = self.create_categories(requests)
+        full_categories = self.create_categories(max(requests // 10, 1), CASCADE_PETS)
+        return [
+            ('GET /', [('GET', '/', None)] * requests),
+            ('GET /pets?limit=100', [('GET', '/pets?limit=100', None)] * requests),
+            ('GET /pets?category&limit=100',
+             [('GET', '/pets?category={}&limit=100'.format(category), None)] * requests),
+            ('GET /pets?name', [('GET', '/pets?name={}'.format(name), None)] * requests),
+            ('GET /pets?available&limit=100',
+             [('GET', '/pets?available=true&limit=100', None)] * requests),
+            ('GET /pets/sorted?limit=100', [('GET', '/pets/sorted?limit=100', None)] * requests),
+            ('GET /pets/search?q&limit=100',
+             [('GET', '/pets/search?q={}&limit=100'.format(name[:-1] + 'x'), None)] * requests),
+            ('GET /pets/stats', [('GET', '/pets/stats', None)] * requests),
+            ('GET /categories/stats', [('GET', '/categories/stats', None)] * requests),
+            ('GET /pets/{id}', [('GET', '/pets/{}'.format(self.any_pet()), None)
+                                for _ in range(requests)]),
+            ('POST /pets', [('POST', '/pets', self.new_pet()) for _ in range(requests)]),
+            ('POST /pets/bulk', [('POST', '/pets/bulk', [self.new_pet() for _ in range(100)])
+                                 for _ in range(requests)]),
+            ('PUT /pets/{id}', [('PUT', '/pets/{}'.format(self.any_pet()), self.new_pet())
+                                for _ in range(requests)]),
+            ('PATCH /pets/{id}', [('PATCH', '/pets/{}'.format(self.any_pet()), {'name': 'patched'})
+                                  for _ in range(requests)]),
+            ('POST /pets/{id}/purchase', [('POST', '/pets/{}/purchase'.format(self.any_pet()), None)
+                                          for _ in range(requests)]),
+            ('PATCH /pets?id', [('PATCH', '/pets?id={}'.format(self.any_pet()), {'available': False})
+                                 for _ in range(requests)]),
+            ('DELETE /pets/{id}', [('DELETE', '/pets/{}'.format(next(victims)), None)
+                                   for _ in range(requests)]),
+            ('DELETE /pets?id', [('DELETE', '/pets?id={}'.format(next(victims)), None)
+                                  for _ in range(requests)]),
+            ('GET /categories', [('GET', '/categories', None)] * requests),
+            ('GET /categories?embed=members&limit=2',
+             [('GET', '/categories?embed=members&limit=2', None)] * max(requests // 10, 1)),
+            ('GET /categories/{id}', [('GET', '/categories/{}'.format(category), None)] * requests),
+            ('PUT /categories/{id}', [('PUT', '/categories/{}'.format(category), {'name': 'Dog'})
+                                      for _ in range(requests)]),
+            ('PATCH /categories/{id}', [('PATCH', '/categories/{}'.format(category),
+                                         {'name': 'Dog'}) for _ in range(requests)]),
+            ('POST /categories', [('POST', '/categories', {'name': 'bench'})] * requests),
+            ('DELETE /categories/{id}', [('DELETE', '/categories/{}'.format(category_id), None)
+                                         for category_id in empty_categories]),
+            ('DELETE /categories/{{id}} with {} pets'.format(CASCADE_PETS),
+             [('DELETE', '/categories/{}'.format(category_id), None)
+              for category_id in full_categories]),
+        ]
+
+
+######################################################################
+#  C L I E N T S
+######################################################################
+
+class TestClient(object):
+    """ Sends requests through the Flask test client in this process """
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body):
+        """ Sends a request and returns the status code """
+        response = self.client.open(path, method=method, json=body)
+        response.get_data()
+        return response.status_code
+
+    def peak_rss(self):
+        """ Peak resident memory of this process in kB """
+        return {'client': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+
+class HttpClient(object):
+    """ Sends requests over HTTP to a gunicorn server """
+
+    def __init__(self, port, process):
+        self.port = port
+        self.process = process
+        self.connections = {}
+
+    def request(self, method, path, body):
+        """ Sends a request on this thread's keep-alive connection """
+        connection = self.connections.get(threading.get_ident())
+        if connection is None:
+            connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            self.connections[threading.get_ident()] = connection
+        headers = {}
+        data = None
+        if body is not None:
+            data = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            connection.request(method, path, data, headers)
+            response = connection.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            # gunicorn sync workers close the connection after each response
+            connection.close()
+            connection.request(method, path, data, headers)
+            response = connection.getresponse()
+            response.read()
+        return response.status
+
+    def peak_rss(self):
+        """ Peak resident memory of the gunicorn master and workers in kB """
+        pids = [self.process.pid] + child_pids(self.process.pid)
+        return dict(('gunicorn' if pid == self.process.pid else 'worker-{}'.format(pid),
+                     read_peak_rss(pid)) for pid in pids)
+
+def child_pids(pid):
+    """ Returns the ids of the child processes of a process (Linux only) """
+    try:
+        with open('/proc/{0}/task/{0}/children'.format(pid)) as children:
+            return [int(child) for child in children.read().split()]
+    except OSError:
+        return []
+
+def read_peak_rss(pid):
+    """ Returns the peak resident memory of a process in kB (Linux only) """
+    try:
+        with open('/proc/{}/status'.format(pid)) as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def start_gunicorn(database_uri, workers=None, worker_class=None, config=None, env=None):
+    """
+    Starts a gunicorn server on a free port and waits until it answers
+
+    With a config file the workers and worker class it chooses are used
+    unless they are given, and env can set the variables it reads.
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    env = dict(os.environ, DATABASE_URI=database_uri, **(env or {}))
+    command = [sys.executable, '-m', 'gunicorn', '--bind', '127.0.0.1:{}'.format(port),
+               '--log-level', 'warning']
+    if config:
+        command += ['--config', config]
+    if workers:
+        command += ['--workers', str(workers)]
+    if worker_class:
+        command += ['--worker-class', worker_class]
+    command.append('app:app')
+    process = subprocess.Popen(command, env=env)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return port, process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError('gunicorn exited with code {}'.format(process.returncode))
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('gunicorn did not start')
+
+
+######################################################################
+#  M E A S U R E M E N T
+######################################################################
+
+def percentile(values, percent):
+    """ Returns the nearest-rank percentile of sorted values """
+    if not values:
+        return None
+    rank = max(int(math.ceil(percent / 100.0 * len(values))) - 1, 0)
+    return values[rank]
+
+def measure(client, requests, concurrency=1, warmup=5):
+    """ Sends the requests and returns the throughput and latency of the route """
+    for method, path, body in requests[:warmup]:
+        if method == 'GET':
+            client.request(method, path, body)
+
+    def timed(request):
+        start = time.perf_counter()
+        code = client.request(*request)
+        return time.perf_counter() - start, code
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(concurrency) as executor:
+            results = list(executor.map(timed, requests))
+    else:
+        results = [timed(request) for request in requests]
+    elapsed = time.perf_counter() - start
+    latencies = sorted(latency for latency, _ in results)
+    codes = {}
+    for _, code in results:
+        codes[str(code)] = codes.get(str(code), 0) + 1
+    return {
+        'requests': len(results),
+        'throughput': len(results) / elapsed if elapsed else None,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': latencies[-1] * 1000,
+        'status': codes,
+    }
+
+def run_routes(client, routes, concurrency=1):
+    """ Measures every route with a client """
+    results = {}
+    for name, requests in routes:
+        results[name] = measure(client, requests, concurrency)
+        print('{:<45} {:>9.1f} req/s  p50 {:>8.2f} ms  p99 {:>8.2f} ms'.format(
+            name, results[name]['throughput'], results[name]['p50_ms'],
+            results[name]['p99_ms']), file=sys.stderr)
+    return results
+
+def git_commit():
+    """ Returns the commit being benchmarked """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+######################################################################
+#   M A I N
+######################################################################
+
+def main(argv=None):
+    """ Runs the benchmarks and writes the JSON report """
+    parser = argparse.ArgumentParser(description='Benchmark every route of the Pet API')
+    parser.add_argument('--database-uri', default=os.getenv('DATABASE_URI', DEFAULT_DATABASE_URI))
+    parser.add_argument('--pets', type=int, default=1000, help='number of Pets to seed')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--mode', choices=['client', 'gunicorn', 'both'], default='both')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--worker-class', default='sync', help='gunicorn worker class')
+    parser.add_argument('--concurrency', type=int, default=1, help='parallel HTTP clients')
+    parser.add_argument('--output', help='JSON report file (default stdout)')
+    args = parser.parse_args(argv)
+
+    # the app reads its database from the environment when it is imported
+    os.environ['DATABASE_URI'] = args.database_uri
+    from app import app, db, models
+    app.logger.setLevel('WARNING')
+
+    workload = Workload(db, models, args.pets)
+    start = time.perf_counter()
+    workload.seed()
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'database': db.engine.dialect.name,
+            'pets': args.pets,
+            'requests': args.requests,
+            'seed_seconds': time.perf_counter() - start,
+        },
+        'results': {},
+        'peak_rss_kb': {},
+    }
+    print('Seeded {} Pets in {:.1f}s'.format(args.pets, report['meta']['seed_seconds']),
+          file=sys.stderr)
+
+    if args.mode in ('client', 'both'):
+        client = TestClient(app)
+        report['results']['client'] = run_routes(client, workload.routes(args.requests))
+        report['peak_rss_kb']['client'] = client.peak_rss()
+
+    if args.mode in ('gunicorn', 'both'):
+        db.engine.dispose()
+        port, process = start_gunicorn(args.database_uri, args.workers, args.worker_class)
+        try:
+            client = HttpClient(port, process)
+            report['meta'].update(workers=args.workers, worker_class=args.worker_class,
+                                  concurrency=args.concurrency)
+            report['results']['gunicorn'] = run_routes(client, workload.routes(args.requests),
+                                                       args.concurrency)
+            report['peak_rss_kb']['gunicorn'] = client.peak_rss()
+        finally:
+            process.terminate()
+            process.wait()
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Serialization Benchmark
+
+Times reading and encoding a page of Pets three ways:
+
+orm - Pet instances from the query, serialize() and jsonify
+rows - plain rows from Pet.as_rows() encoded with the standard library
+rows+orjson - plain rows from Pet.as_rows() encoded with encode_json()
+
+Usage:
+    python -m benchmarks.serialization [--pets N] [--page N] [--repeat N]
+"""
+import os
+import sys
+import time
+import argparse
+from benchmarks.run import DEFAULT_DATABASE_URI, Workload
+
+
+def best_time(function, repeat):
+    """ Returns the fastest of a number of runs in milliseconds """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+def main(argv=None):
+    """ Runs the serialization benchmark """
+    parser = argparse.ArgumentParser(description='Benchmark the list serialization paths')
+    parser.add_argument('--database-uri', default=os.getenv('DATABASE_URI', DEFAULT_DATABASE_URI))
+    parser.add_argument('--pets', type=int, default=100000, help='number of Pets to seed')
+    parser.add_argument('--page', type=int, default=1000, help='Pets per page')
+    parser.add_argument('--repeat', type=int, default=20, help='runs of each path')
+    args = parser.parse_args(argv)
+
+    os.environ['DATABASE_URI'] = args.database_uri
+    from flask import json, jsonify
+    from app import app, db, models, encoding
+    from app.server import serialize_row
+    app.logger.setLevel('WARNING')
+    Workload(db, models, args.pets).seed()
+    pet = models.Pet
+
+    def orm():
+        pets = pet.query.order_by(pet.id).limit(args.page).all()
+        body = jsonify([item.serialize() for item in pets]).get_data()
+        db.session.remove()
+        return body
+
+    def rows():
+        page = pet.as_rows(pet.query).order_by(pet.id).limit(args.page).all()
+        data = [serialize_row(row) for row in page]
+        body = (json.dumps(data, separators=(',', ':')) + '\n').encode('utf-8')
+        db.session.remove()
+        return body
+
+    def rows_orjson():
+        page = pet.as_rows(pet.query).order_by(pet.id).limit(args.page).all()
+        body = encoding.encode_json([serialize_row(row) for row in page], app)
+        db.session.remove()
+        return body
+
+    with app.app_context():
+        if not orm() == rows() == rows_orjson():
+            print('The paths encode different bodies', file=sys.stderr)
+            return 1
+        baseline = best_time(orm, args.repeat)
+        print('{} Pets per page, best of {} runs'.format(args.page, args.repeat))
+        print('orm          {:8.2f} ms'.format(baseline))
+        for name, function in [('rows', rows), ('rows+orjson', rows_orjson)]:
+            elapsed = best_time(function, args.repeat)
+            print('{:<12} {:8.2f} ms  {:.1f}x'.format(name, elapsed, baseline / elapsed))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
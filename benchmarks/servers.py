@@ -0,0 +1,92 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Server Mode Benchmark
+
+Seeds the database once and then serves the Pet routes with gunicorn
+started from gunicorn.conf.py in each worker mode, sending the requests
+from a number of parallel clients. Modes whose worker class is not
+installed (gevent, which also needs psycogreen) are skipped.
+
+Usage:
+    python -m benchmarks.servers [--modes sync,gthread,gevent] [--concurrency N]
+                                 [--pets N] [--requests N] [--output FILE]
+"""
+import os
+import sys
+import json
+import argparse
+import importlib.util
+from benchmarks.run import (DEFAULT_DATABASE_URI, Workload, HttpClient, start_gunicorn,
+                            run_routes, git_commit)
+
+CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                      'gunicorn.conf.py')
+
+
+def pet_routes(workload, requests):
+    """ Returns the routes of the Pets resource """
+    return [(name, reqs) for name, reqs in workload.routes(requests)
+            if name.split()[1].startswith('/pets')]
+
+def main(argv=None):
+    """ Runs every worker mode and writes the JSON report """
+    parser = argparse.ArgumentParser(description='Compare the gunicorn worker modes')
+    parser.add_argument('--database-uri', default=os.getenv('DATABASE_URI', DEFAULT_DATABASE_URI))
+    parser.add_argument('--modes', default='sync,gthread,gevent', help='comma separated modes')
+    parser.add_argument('--pets', type=int, default=1000, help='number of Pets to seed')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=8, help='parallel HTTP clients')
+    parser.add_argument('--workers', type=int, help='override the workers chosen by the config')
+    parser.add_argument('--output', help='JSON report file (default stdout)')
+    args = parser.parse_args(argv)
+
+    os.environ['DATABASE_URI'] = args.database_uri
+    from app import app, db, models
+    workload = Workload(db, models, args.pets)
+    workload.seed()
+    db.engine.dispose()
+
+    report = {'meta': {'commit': git_commit(), 'database': db.engine.dialect.name,
+                       'pets': args.pets, 'requests': args.requests,
+                       'concurrency': args.concurrency, 'cpus': os.cpu_count()},
+              'results': {}, 'peak_rss_kb': {}, 'skipped': []}
+    for mode in args.modes.split(','):
+        if mode == 'gevent' and (importlib.util.find_spec('gevent') is None
+                                 or importlib.util.find_spec('psycogreen') is None):
+            print('Skipping gevent: gevent or psycogreen is not installed', file=sys.stderr)
+            report['skipped'].append(mode)
+            continue
+        print('Mode {}'.format(mode), file=sys.stderr)
+        port, process = start_gunicorn(args.database_uri, args.workers, config=CONFIG,
+                                       env={'GUNICORN_MODE': mode, 'ACCESS_LOG': 'false'})
+        try:
+            client = HttpClient(port, process)
+            report['results'][mode] = run_routes(client, pet_routes(workload, args.requests),
+                                                 args.concurrency)
+            report['peak_rss_kb'][mode] = client.peak_rss()
+        finally:
+            process.terminate()
+            process.wait()
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Startup Benchmark
+
+Measures in fresh Python processes how long it takes to import the app
+package, to create an app, and to serve the first request, which is when
+the database driver is imported and the first connection is opened.
+
+Usage:
+    python -m benchmarks.startup [--runs N] [--output FILE]
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from benchmarks.run import DEFAULT_DATABASE_URI
+
+# Runs in each child process and prints its timings as JSON
+CHILD = '''
+import time, json
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app()
+created = time.perf_counter()
+flask_app.test_client().get('/pets?limit=1')
+served = time.perf_counter()
+print(json.dumps({'import_ms': (imported - started) * 1000,
+                  'create_ms': (created - imported) * 1000,
+                  'first_request_ms': (served - created) * 1000,
+                  'total_ms': (served - started) * 1000}))
+'''
+
+
+def main(argv=None):
+    """ Runs the startup benchmark """
+    parser = argparse.ArgumentParser(description='Benchmark the startup of the Pet Service')
+    parser.add_argument('--database-uri', default=os.getenv('DATABASE_URI', DEFAULT_DATABASE_URI))
+    parser.add_argument('--runs', type=int, default=10, help='fresh processes to time')
+    parser.add_argument('--output', help='JSON report file (default stdout)')
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ, DATABASE_URI=args.database_uri, ACCESS_LOG='false')
+    # make sure the tables exist so the first request runs a real query
+    subprocess.check_call([sys.executable, '-c', 'from app import app, server; server.init_db()'],
+                          env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    runs = []
+    for _ in range(args.runs):
+        output = subprocess.check_output([sys.executable, '-c', CHILD], env=env,
+                                         stderr=subprocess.DEVNULL)
+        runs.append(json.loads(output.decode().strip().splitlines()[-1]))
+    report = {}
+    for key in ('import_ms', 'create_ms', 'first_request_ms', 'total_ms'):
+        values = [run[key] for run in runs]
+        report[key] = {'median': statistics.median(values), 'min': min(values), 'max': max(values)}
+    output = json.dumps({'runs': args.runs, 'startup': report}, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
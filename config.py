@@ -3,9 +3,10 @@ Configuration File
 
 Load with: app.config.from_object('config')
 """
-#import os
+import os
 import logging
-from app.vcap_services import get_database_uri
+from app.vcap_services import get_engine_options, get_replica_uris
+from app.logs import parse_sample_rates
 
 # basedir = os.path.abspath(os.path.dirname(__file__))
 
@@ -15,7 +16,44 @@ from app.vcap_services import get_database_uri
 #     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'db/development.db')
 
 SQLALCHEMY_TRACK_MODIFICATIONS = False
-SQLALCHEMY_DATABASE_URI = get_database_uri()
+# None means create_app() reads it with get_database_uri() when the app is made
+SQLALCHEMY_DATABASE_URI = None
+# Connection pool settings of each worker (ignored for SQLite)
+DATABASE_POOL_OPTIONS = get_engine_options()
+# Pool checkouts and connects slower than this many seconds are logged
+POOL_SLOW_THRESHOLD = float(os.getenv('DB_POOL_SLOW_THRESHOLD', '0.1'))
+# Read replicas for the GET requests of the read-only endpoints
+DATABASE_REPLICA_URIS = get_replica_uris()
+# Seconds between the health checks of a replica
+REPLICA_HEALTH_INTERVAL = float(os.getenv('DB_REPLICA_HEALTH_INTERVAL', '5'))
+# Seconds a client reads from the primary after it writes (0 = never)
+READ_YOUR_WRITES_SECONDS = int(os.getenv('READ_YOUR_WRITES_SECONDS', '5'))
+# Queries slower than this many seconds are logged with their parameters
+SLOW_QUERY_THRESHOLD = float(os.getenv('SLOW_QUERY_THRESHOLD', '0.5'))
+
+# Page size used by the list endpoints when no limit is given (0 = all rows)
+DEFAULT_PAGE_SIZE = int(os.getenv('DEFAULT_PAGE_SIZE', '100')) or None
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', '1000'))
+# Rows fetched from the server-side cursor per chunk of a streamed list
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', '1000'))
+# Rows per multi-row INSERT in POST /pets/bulk
+BULK_BATCH_SIZE = int(os.getenv('BULK_BATCH_SIZE', '1000'))
+# Seconds the in-process Category cache is kept (0 = don't cache)
+CATEGORY_CACHE_TTL = int(os.getenv('CATEGORY_CACHE_TTL', '300'))
+# Keep per-Category Pet counters on every write so the stats don't count every Pet
+STATS_COUNTERS = os.getenv('STATS_COUNTERS', 'false').lower() in ['true', '1', 't']
+# Cache of list pages: memory (per worker), redis (shared) or none
+RESULT_CACHE_BACKEND = os.getenv('RESULT_CACHE_BACKEND', 'memory')
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', '1024'))
+RESULT_CACHE_URL = os.getenv('RESULT_CACHE_URL', 'redis://localhost:6379/0')
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', '300'))
 
 SECRET_KEY = 'secret-for-dev-only'
 LOGGING_LEVEL = logging.INFO
+# Write logs from a listener thread so requests never wait on STDOUT
+LOG_QUEUE = os.getenv('LOG_QUEUE', 'true').lower() in ['true', '1', 't']
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+# Fraction of requests whose INFO messages are logged, e.g. list_pets=0.01,get_pets=0.1
+LOG_SAMPLE_RATES = parse_sample_rates(os.getenv('LOG_SAMPLE_RATES'))
+# One JSON line per request with its status and timing
+ACCESS_LOG = os.getenv('ACCESS_LOG', 'true').lower() in ['true', '1', 't']
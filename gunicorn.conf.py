@@ -0,0 +1,116 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Gunicorn Configuration
+
+Start the Pet Service with: gunicorn -c gunicorn.conf.py app:app
+
+The worker mode is chosen with GUNICORN_MODE:
+    sync - one request at a time per worker, 2 x CPUs + 1 workers
+    gthread - a pool of GUNICORN_THREADS threads per worker, CPUs + 1 workers (default)
+    gevent - thousands of green threads per worker, one worker per CPU
+             (needs gevent and psycogreen, which makes psycopg2 yield)
+
+WEB_CONCURRENCY overrides the number of workers, and every worker is
+replaced after about GUNICORN_MAX_REQUESTS (1000) requests. The app is
+preloaded in the master so the workers share its memory, and every worker
+throws away the database connections it inherited so no two processes
+ever talk over the same socket.
+
+The /metrics of every worker are added up in PROMETHEUS_MULTIPROC_DIR,
+which defaults to a temporary directory that is removed on exit. It is
+set here, before the app is preloaded, because prometheus_client picks
+its storage when it is imported.
+"""
+import os
+import glob
+import shutil
+import tempfile
+import multiprocessing
+
+CPUS = multiprocessing.cpu_count()
+MODE = os.getenv('GUNICORN_MODE', 'gthread')
+
+if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='pet-metrics-')
+    os.environ['PET_METRICS_TEMP_DIR'] = os.environ['PROMETHEUS_MULTIPROC_DIR']
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:{}'.format(os.getenv('PORT', '5000')))
+preload_app = True
+accesslog = None    # the app writes its own access log
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+# Restart workers now and then so a slow leak can't grow without bound,
+# at staggered counts so they don't all restart at once (0 turns it off)
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '1000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', max_requests // 10))
+
+if MODE == 'sync':
+    worker_class = 'sync'
+    workers = 2 * CPUS + 1
+elif MODE == 'gthread':
+    worker_class = 'gthread'
+    threads = int(os.getenv('GUNICORN_THREADS', '4'))
+    workers = CPUS + 1
+elif MODE == 'gevent':
+    # fail at startup rather than block a whole worker on every query
+    from psycogreen.gevent import patch_psycopg
+    worker_class = 'gevent'
+    worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
+    workers = CPUS
+else:
+    raise ValueError('Unknown GUNICORN_MODE: {}'.format(MODE))
+workers = int(os.getenv('WEB_CONCURRENCY', workers))
+
+
+def on_starting(server):
+    """ Clears the metrics files left by workers of an earlier run """
+    directory = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        for path in glob.glob(os.path.join(directory, '*.db')):
+            os.remove(path)
+
+def post_fork(server, worker):
+    """ Gives the new worker its own connection pool and logging thread """
+    from app import db, get_app, server as pet_server, pool_metrics
+    if MODE == 'gevent':
+        # let psycopg2 wait on the gevent hub instead of blocking the worker
+        patch_psycopg()
+    app = get_app()
+    with app.app_context():
+        engine = db.engine
+        try:
+            # drop the pool without closing the connections the master still owns
+            engine.dispose(close=False)
+        except TypeError:
+            # SQLAlchemy before 1.4.33 has no close argument
+            engine.pool = engine.pool.recreate()
+    pool_metrics.reset()
+    # the queue logging thread of the master does not survive the fork
+    pet_server.initialize_logging(app=app)
+    server.log.info('Worker %s ready with a fresh connection pool', worker.pid)
+
+def child_exit(server, worker):
+    """ Removes the live metrics of a worker that has exited """
+    from app import metrics
+    metrics.mark_process_dead(worker.pid)
+
+def on_exit(server):
+    """ Removes the metrics directory this config created """
+    directory = os.getenv('PET_METRICS_TEMP_DIR')
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
@@ -70,6 +70,9 @@ def run_migrations_online():
                                 poolclass=pool.NullPool)
 
     connection = engine.connect()
+    if connection.dialect.name == 'sqlite':
+        # batch migrations drop and copy tables, which must not cascade
+        connection.exec_driver_sql('PRAGMA foreign_keys=OFF')
     context.configure(connection=connection,
                       target_metadata=target_metadata,
                       process_revision_directives=process_revision_directives,
@@ -0,0 +1,51 @@
+"""add pet name search
+
+Revision ID: 3f6d9e1a2c57
+Revises: 8e4a0d6c9b12
+Create Date: 2026-10-17 11:24:08.517932
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6d9e1a2c57'
+down_revision = '8e4a0d6c9b12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.execute('CREATE INDEX ix_pet_name_trgm ON pet USING gin (name gin_trgm_ops)')
+        op.execute('CREATE INDEX ix_pet_name_lower_pattern ON pet (lower(name) text_pattern_ops)')
+    elif dialect == 'sqlite' and op.get_bind().dialect.server_version_info >= (3, 34):
+        # the trigram tokenizer is new in SQLite 3.34, older ones search with LIKE
+        op.execute("CREATE VIRTUAL TABLE pet_search USING fts5("
+                   "name, content='pet', content_rowid='id', tokenize='trigram')")
+        op.execute("CREATE TRIGGER pet_search_insert AFTER INSERT ON pet BEGIN "
+                   "INSERT INTO pet_search(rowid, name) VALUES (new.id, new.name); END")
+        op.execute("CREATE TRIGGER pet_search_delete AFTER DELETE ON pet BEGIN "
+                   "INSERT INTO pet_search(pet_search, rowid, name) "
+                   "VALUES ('delete', old.id, old.name); END")
+        op.execute("CREATE TRIGGER pet_search_update AFTER UPDATE OF name ON pet BEGIN "
+                   "INSERT INTO pet_search(pet_search, rowid, name) "
+                   "VALUES ('delete', old.id, old.name); "
+                   "INSERT INTO pet_search(rowid, name) VALUES (new.id, new.name); END")
+        # index the Pets that are already there
+        op.execute("INSERT INTO pet_search(pet_search) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.drop_index('ix_pet_name_lower_pattern', table_name='pet')
+        op.drop_index('ix_pet_name_trgm', table_name='pet')
+    elif dialect == 'sqlite':
+        op.execute('DROP TRIGGER IF EXISTS pet_search_update')
+        op.execute('DROP TRIGGER IF EXISTS pet_search_delete')
+        op.execute('DROP TRIGGER IF EXISTS pet_search_insert')
+        op.execute('DROP TABLE IF EXISTS pet_search')
@@ -0,0 +1,59 @@
+"""cascade category deletes
+
+Revision ID: c4e9b7d15a38
+Revises: a7c2e4f81b90
+Create Date: 2026-10-17 13:12:36.418205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e9b7d15a38'
+down_revision = 'a7c2e4f81b90'
+branch_labels = None
+depends_on = None
+
+# the name PostgreSQL gave the unnamed foreign key, used on SQLite as well
+FOREIGN_KEY = 'pet_category_id_fkey'
+NAMING_CONVENTION = {'fk': '%(table_name)s_%(column_0_name)s_fkey'}
+
+
+def upgrade():
+    replace_foreign_key(ondelete='CASCADE')
+
+
+def downgrade():
+    replace_foreign_key(ondelete=None)
+
+
+def replace_foreign_key(ondelete):
+    """ Recreates the foreign key from pet to category with the ondelete action """
+    if op.get_bind().dialect.name == 'sqlite':
+        # SQLite can only change a foreign key by copying the table
+        with op.batch_alter_table('pet', recreate='always',
+                                  naming_convention=NAMING_CONVENTION) as batch_op:
+            batch_op.drop_constraint(FOREIGN_KEY, type_='foreignkey')
+            batch_op.create_foreign_key(FOREIGN_KEY, 'category', ['category_id'], ['id'],
+                                        ondelete=ondelete)
+        # dropping the old table dropped the triggers of the name search
+        if op.get_bind().dialect.server_version_info >= (3, 34):
+            create_search_triggers()
+    else:
+        op.drop_constraint(FOREIGN_KEY, 'pet', type_='foreignkey')
+        op.create_foreign_key(FOREIGN_KEY, 'pet', 'category', ['category_id'], ['id'],
+                              ondelete=ondelete)
+
+
+def create_search_triggers():
+    """ Creates the triggers that keep pet_search in step with pet """
+    op.execute("CREATE TRIGGER pet_search_insert AFTER INSERT ON pet BEGIN "
+               "INSERT INTO pet_search(rowid, name) VALUES (new.id, new.name); END")
+    op.execute("CREATE TRIGGER pet_search_delete AFTER DELETE ON pet BEGIN "
+               "INSERT INTO pet_search(pet_search, rowid, name) "
+               "VALUES ('delete', old.id, old.name); END")
+    op.execute("CREATE TRIGGER pet_search_update AFTER UPDATE OF name ON pet BEGIN "
+               "INSERT INTO pet_search(pet_search, rowid, name) "
+               "VALUES ('delete', old.id, old.name); "
+               "INSERT INTO pet_search(rowid, name) VALUES (new.id, new.name); END")
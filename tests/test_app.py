@@ -0,0 +1,86 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Application Factory Test Suite
+
+Test cases can be run with the following:
+nosetests -v --with-spec --spec-color
+coverage report -m
+"""
+
+import os
+import sys
+import unittest
+import subprocess
+from flask_api import status    # HTTP Status Codes
+from app.models import Pet, Category
+from app import create_app, get_app, db
+
+ISOLATED_URI = 'sqlite:////tmp/test_isolated.db'
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestAppFactory(unittest.TestCase):
+    """ Application Factory Test Cases """
+
+    def setUp(self):
+        self.app = create_app({'SQLALCHEMY_DATABASE_URI': ISOLATED_URI,
+                               'RESULT_CACHE_BACKEND': 'none'})
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        if os.path.exists(ISOLATED_URI[len('sqlite:///'):]):
+            os.remove(ISOLATED_URI[len('sqlite:///'):])
+
+    def test_isolated_app(self):
+        """ Serve an app with its own configuration and database """
+        self.assertIsNot(self.app, get_app())
+        self.assertEqual(self.app.config['SQLALCHEMY_DATABASE_URI'], ISOLATED_URI)
+        with self.app.app_context():
+            db.create_all()
+            category = Category(name='Dog')
+            category.save()
+            Pet(name='fido', category_id=category.id, available=True).save()
+            db.session.remove()
+        resp = self.app.test_client().get('/pets')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([pet['name'] for pet in resp.get_json()], ['fido'])
+
+    def test_startup_times(self):
+        """ Record the creation and first request times of an app """
+        startup = self.app.extensions['startup']
+        self.assertGreater(startup['import_seconds'], 0)
+        self.assertGreater(startup['create_seconds'], 0)
+        self.assertIsNone(startup['first_request_seconds'])
+        self.app.test_client().get('/metrics')
+        self.assertGreater(startup['first_request_seconds'], startup['create_seconds'])
+
+    def test_lazy_import(self):
+        """ Import the package without a database driver or an app """
+        code = ('import sys, app; '
+                'print("psycopg2" in sys.modules, app._default_app is None)')
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(output.split(), [b'False', b'True'])
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Result Cache Test Suite
+
+Test cases can be run with the following:
+nosetests -v --with-spec --spec-color
+coverage report -m
+"""
+
+import unittest
+from app.cache import MemoryCache, RedisCache, NullCache, create_cache
+
+
+class FakeRedis(object):
+    """ Local stand-in for a Redis client """
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+        self.expires[key] = ex
+
+
+class BrokenRedis(object):
+    """ Redis client whose server is down """
+    def get(self, key):
+        raise ConnectionError('down')
+
+    def set(self, key, value, ex=None):
+        raise ConnectionError('down')
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestResultCache(unittest.TestCase):
+    """ Test Cases for the Result Cache backends """
+
+    def test_memory_cache(self):
+        """ Store and fetch values in memory """
+        cache = MemoryCache(max_entries=2)
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', b'1')
+        self.assertEqual(cache.get('a'), b'1')
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'size': 1})
+        cache.clear()
+        self.assertIsNone(cache.get('a'))
+
+    def test_memory_cache_evicts_least_recently_used(self):
+        """ Evict the least recently used value when full """
+        cache = MemoryCache(max_entries=2)
+        cache.set('a', b'1')
+        cache.set('b', b'2')
+        cache.get('a')
+        cache.set('c', b'3')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), b'1')
+        self.assertEqual(cache.get('c'), b'3')
+
+    def test_redis_cache(self):
+        """ Store and fetch values through a Redis client """
+        client = FakeRedis()
+        cache = RedisCache(client, ttl=60)
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', b'1')
+        self.assertEqual(cache.get('a'), b'1')
+        self.assertEqual(client.expires['pets:a'], 60)
+        # a second worker shares the entries
+        self.assertEqual(RedisCache(client).get('a'), b'1')
+
+    def test_redis_cache_down(self):
+        """ Miss instead of failing when Redis is down """
+        cache = RedisCache(BrokenRedis())
+        cache.set('a', b'1')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_create_cache(self):
+        """ Create the backend named in the config """
+        self.assertIsInstance(create_cache({}), MemoryCache)
+        self.assertIsInstance(create_cache({'RESULT_CACHE_BACKEND': 'none'}), NullCache)
+        self.assertRaises(ValueError, create_cache, {'RESULT_CACHE_BACKEND': 'foo'})
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
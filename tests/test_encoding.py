@@ -0,0 +1,65 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+JSON Encoding Test Suite
+
+Test cases can be run with the following:
+nosetests -v --with-spec --spec-color
+coverage report -m
+"""
+
+import unittest
+from decimal import Decimal
+from flask import jsonify
+from app.encoding import encode_json
+from app import app
+
+SAMPLES = [
+    [],
+    [{'name': 'fido', 'id': 1, 'category_id': 2, 'available': True}],
+    [{'name': 'Señor Whiskers \U0001f431', 'id': 2, 'category_id': None, 'available': False}],
+    {'status': 404, 'error': 'Not Found', 'message': 'quote " and slash / and tab \t'},
+    {'price': Decimal('9.99')},
+]
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestEncoding(unittest.TestCase):
+    """ JSON Encoding Test Cases """
+
+    def test_same_bytes_as_jsonify(self):
+        """ Encode to the same bytes as jsonify """
+        with app.app_context():
+            for data in SAMPLES:
+                self.assertEqual(encode_json(data, app), jsonify(data).get_data())
+
+    def test_same_bytes_when_pretty(self):
+        """ Encode to the same bytes as jsonify when pretty printing """
+        app.config['JSONIFY_PRETTYPRINT_REGULAR'] = True
+        try:
+            with app.app_context():
+                for data in SAMPLES:
+                    self.assertEqual(encode_json(data, app), jsonify(data).get_data())
+        finally:
+            app.config['JSONIFY_PRETTYPRINT_REGULAR'] = False
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Request Logging Test Suite
+
+Test cases can be run with the following:
+nosetests -v --with-spec --spec-color
+coverage report -m
+"""
+
+import queue
+import logging
+import unittest
+from app.logs import QueueLogHandler, SamplingFilter, parse_sample_rates, start_queue_logging
+from app import app
+
+
+class ListHandler(logging.Handler):
+    """ Keeps the records it is given """
+    def __init__(self):
+        super(ListHandler, self).__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def make_record(level, name='app.server'):
+    """ Makes a log record """
+    return logging.LogRecord(name, level, __file__, 1, 'message', None, None)
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestRequestLogging(unittest.TestCase):
+    """ Request Logging Test Cases """
+
+    def test_parse_sample_rates(self):
+        """ Parse the sample rates of the endpoints """
+        self.assertEqual(parse_sample_rates(None), {})
+        self.assertEqual(parse_sample_rates('list_pets=0.01, get_pets=0.5'),
+                         {'list_pets': 0.01, 'get_pets': 0.5})
+
+    def test_sampling_filter(self):
+        """ Sample the INFO records of an endpoint """
+        sampler = SamplingFilter({'list_pets': 0.0, 'get_pets': 1.0})
+        with app.test_request_context('/pets'):
+            self.assertFalse(sampler.filter(make_record(logging.INFO)))
+            self.assertTrue(sampler.filter(make_record(logging.WARNING)))
+            self.assertTrue(sampler.filter(make_record(logging.INFO, 'app.access')))
+        with app.test_request_context('/pets/1'):
+            self.assertTrue(sampler.filter(make_record(logging.INFO)))
+        with app.test_request_context('/categories'):
+            self.assertTrue(sampler.filter(make_record(logging.INFO)))
+        # records outside of a request are always kept
+        self.assertTrue(sampler.filter(make_record(logging.INFO)))
+
+    def test_queue_handler_drops_when_full(self):
+        """ Drop records instead of blocking when the queue is full """
+        handler = QueueLogHandler(queue.Queue(1))
+        handler.handle(make_record(logging.INFO))
+        handler.handle(make_record(logging.INFO))
+        self.assertEqual(handler.queue.qsize(), 1)
+        self.assertEqual(handler.dropped, 1)
+
+    def test_queue_listener(self):
+        """ Write the queued records from the listener thread """
+        target = ListHandler()
+        handler, listener = start_queue_logging([target])
+        target.setFormatter(logging.Formatter('%(levelname)s in %(module)s: %(message)s'))
+        handler.handle(make_record(logging.INFO))
+        listener.stop()
+        self.assertEqual(len(target.records), 1)
+        self.assertEqual(target.format(target.records[0]), 'INFO in test_logs: message')
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
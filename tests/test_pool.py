@@ -0,0 +1,106 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Connection Pool Test Suite
+
+Test cases can be run with the following:
+nosetests -v --with-spec --spec-color
+coverage report -m
+"""
+
+import os
+import json
+import unittest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.engine.url import make_url
+from app.pool import InstrumentedQueuePool, pool_metrics, SQLAlchemy
+from app.vcap_services import get_engine_options
+from app import app
+
+POOL_ENV = ('DB_POOL_SIZE', 'DB_MAX_OVERFLOW', 'DB_POOL_TIMEOUT', 'DB_POOL_RECYCLE',
+            'DB_POOL_PRE_PING', 'VCAP_SERVICES')
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestConnectionPool(unittest.TestCase):
+    """ Connection Pool Test Cases """
+
+    def setUp(self):
+        self.saved_env = dict((name, os.environ.pop(name)) for name in POOL_ENV
+                              if name in os.environ)
+        pool_metrics.reset()
+
+    def tearDown(self):
+        for name in POOL_ENV:
+            os.environ.pop(name, None)
+        os.environ.update(self.saved_env)
+
+    def test_engine_options_from_environment(self):
+        """ Read the pool settings from the environment """
+        self.assertEqual(get_engine_options()['pool_size'], 5)
+        self.assertFalse(get_engine_options()['pool_pre_ping'])
+        os.environ['DB_POOL_SIZE'] = '20'
+        os.environ['DB_POOL_PRE_PING'] = 'true'
+        options = get_engine_options()
+        self.assertEqual(options['pool_size'], 20)
+        self.assertTrue(options['pool_pre_ping'])
+
+    def test_engine_options_from_vcap(self):
+        """ Read the pool settings from VCAP_SERVICES """
+        creds = {'uri': 'postgres://localhost/pets', 'pool': {'pool_size': 8, 'max_overflow': 2}}
+        os.environ['VCAP_SERVICES'] = json.dumps({'dashDB For Transactions': [{'credentials': creds}]})
+        os.environ['DB_MAX_OVERFLOW'] = '4'
+        options = get_engine_options()
+        self.assertEqual(options['pool_size'], 8)
+        self.assertEqual(options['max_overflow'], 4)
+
+    def test_driver_hacks(self):
+        """ Use the instrumented pool except for SQLite """
+        db = SQLAlchemy()
+        options = db.apply_pool_defaults(app, {})
+        self.assertEqual(options['pool_size'], app.config['DATABASE_POOL_OPTIONS']['pool_size'])
+        url, sqlite_options = db.apply_driver_hacks(app, make_url('sqlite://'), dict(options))
+        self.assertNotIn('pool_size', sqlite_options)
+        self.assertNotEqual(sqlite_options['poolclass'], InstrumentedQueuePool)
+        url, options = db.apply_driver_hacks(app, make_url('postgresql://localhost/pets'), options)
+        self.assertEqual(options['poolclass'], InstrumentedQueuePool)
+        self.assertIn('pool_size', options)
+
+    def test_pool_metrics(self):
+        """ Count checkouts, connects and timeouts """
+        engine = create_engine('sqlite://', poolclass=InstrumentedQueuePool,
+                               pool_size=1, max_overflow=0, pool_timeout=0.05)
+        connection = engine.connect()
+        stats = pool_metrics.stats(engine.pool)
+        self.assertEqual(stats['checked_out'], 1)
+        self.assertEqual(stats['connects'], 1)
+        self.assertEqual(stats['size'], 1)
+        self.assertRaises(PoolTimeoutError, engine.connect)
+        stats = pool_metrics.stats(engine.pool)
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertGreaterEqual(stats['wait_time']['max'], 0.05)
+        connection.close()
+        self.assertEqual(pool_metrics.stats()['checked_out'], 0)
+        engine.dispose()
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
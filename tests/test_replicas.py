@@ -0,0 +1,131 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Read Replica Test Suite
+
+The primary and the replica are two SQLite databases that are not
+replicated, so a read shows which one served it.
+
+Test cases can be run with the following:
+nosetests -v --with-spec --spec-color
+coverage report -m
+"""
+
+import os
+import unittest
+from flask_api import status    # HTTP Status Codes
+from app.models import Pet, Category
+from app.replicas import PRIMARY_COOKIE
+from app.vcap_services import get_replica_uris
+from app import create_app, db
+
+PRIMARY_URI = 'sqlite:////tmp/test_primary.db'
+REPLICA_URI = 'sqlite:////tmp/test_replica.db'
+MISSING_URI = 'sqlite:////tmp/no-such-directory/replica.db'
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestReadReplicas(unittest.TestCase):
+    """ Read Replica Test Cases """
+
+    def setUp(self):
+        self.app = self.make_app([REPLICA_URI])
+        with self.app.app_context():
+            db.create_all()
+            db.Model.metadata.create_all(db.get_engine(self.app, bind='replica_0'))
+            category = Category(name='Dog')
+            category.save()
+            self.category_id = category.id
+            Pet(name='fido', category_id=category.id, available=True).save()
+            db.session.remove()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+            db.get_engine(self.app, bind='replica_0').dispose()
+        for uri in (PRIMARY_URI, REPLICA_URI):
+            if os.path.exists(uri[len('sqlite:///'):]):
+                os.remove(uri[len('sqlite:///'):])
+
+    @staticmethod
+    def make_app(replica_uris):
+        return create_app({'SQLALCHEMY_DATABASE_URI': PRIMARY_URI,
+                           'DATABASE_REPLICA_URIS': replica_uris,
+                           'RESULT_CACHE_BACKEND': 'none',
+                           'CATEGORY_CACHE_TTL': 0})
+
+    def test_replica_uris_from_environment(self):
+        """ Read the replica URIs from the environment """
+        saved = os.environ.pop('DATABASE_REPLICA_URIS', None)
+        try:
+            self.assertEqual(get_replica_uris(), [])
+            os.environ['DATABASE_REPLICA_URIS'] = '{}, {}'.format(PRIMARY_URI, REPLICA_URI)
+            self.assertEqual(get_replica_uris(), [PRIMARY_URI, REPLICA_URI])
+        finally:
+            os.environ.pop('DATABASE_REPLICA_URIS', None)
+            if saved is not None:
+                os.environ['DATABASE_REPLICA_URIS'] = saved
+
+    def test_reads_go_to_replica(self):
+        """ Serve the read-only endpoints from the replica """
+        resp = self.client.get('/pets')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), [])
+        resp = self.client.get('/categories')
+        self.assertEqual(resp.get_json(), [])
+        resp = self.client.get('/categories/{}'.format(self.category_id))
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.client.get('/pool/stats')
+        self.assertEqual(resp.get_json()['replicas'], {'replica_0': True})
+
+    def test_writes_go_to_primary(self):
+        """ Write to the primary and read your writes from it """
+        resp = self.client.post('/pets', json={'name': 'kitty', 'category_id': self.category_id,
+                                               'available': True})
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertIn(PRIMARY_COOKIE, resp.headers['Set-Cookie'])
+        resp = self.client.get('/pets')
+        self.assertEqual(sorted(pet['name'] for pet in resp.get_json()), ['fido', 'kitty'])
+        # a client without the cookie still reads from the replica
+        resp = self.app.test_client().get('/pets')
+        self.assertEqual(resp.get_json(), [])
+
+    def test_failover_to_primary(self):
+        """ Read from the primary when the replica is down """
+        app = self.make_app([MISSING_URI])
+        resp = app.test_client().get('/pets')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([pet['name'] for pet in resp.get_json()], ['fido'])
+        self.assertEqual(app.extensions['replicas'].status(), {'replica_0': False})
+
+    def test_no_replicas(self):
+        """ Read from the primary when no replica is configured """
+        app = self.make_app([])
+        self.assertIsNone(app.extensions['replicas'])
+        resp = app.test_client().get('/pets')
+        self.assertEqual([pet['name'] for pet in resp.get_json()], ['fido'])
+        self.assertNotIn('Set-Cookie', app.test_client().post(
+            '/categories', json={'name': 'Cat'}).headers)
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()